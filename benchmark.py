@@ -0,0 +1,422 @@
+#!/usr/bin/env python3
+
+'''
+Benchmarks for PDF pipeline
+
+a synthetic corpus is generated locally with reportlab,
+    parameterized by number of pages, annotations per page,
+        outline size and depth, and runs of page labels
+
+each public entry point is timed in a separate process,
+    recording wall time and peak RSS to a JSON results file,
+        which could be compared with a stored baseline
+
+usage:
+    python3 -m pdfpy.benchmark -o results.json [-b baseline.json]
+
+    or only check outline conversions scale linearly, up to a million entries
+    python3 -m pdfpy.benchmark --outline-scaling-only
+'''
+
+import os
+import sys
+import gc
+import json
+import time
+import platform
+import argparse
+import resource
+import multiprocessing
+
+import PyPDF2
+
+from reportlab.pdfgen import canvas
+
+from .funcs_pdf import copy_pdf, merge_pdfs, pdf_edit_headlabel_outline
+from .cache import hash_bytes
+from .funcs_outline import get_outlines_from_pdf, outline_level_to_nest, \
+                           outline_nest_to_level
+
+# synthetic corpus
+corpus_default=[
+    dict(name='small', num_pages=50, num_annots=2,
+                       num_outlines=50, outline_depth=2, pagelabel_runs=2),
+    dict(name='large', num_pages=1000, num_annots=5,
+                       num_outlines=1000, outline_depth=3, pagelabel_runs=5),
+]
+
+def mkpdf_synthetic(fname, num_pages=100, num_annots=0,
+                        num_outlines=0, outline_depth=1, pagelabel_runs=0):
+    '''
+        make a synthetic pdf
+
+        Parameters:
+            num_annots: int
+                number of link annotations in each page
+
+            num_outlines, outline_depth: int
+                number and max depth of outline entries
+                    which are spread over pages evenly
+
+            pagelabel_runs: int
+                number of page label runs
+                    with styles alternating between roman and arabic
+    '''
+    c=canvas.Canvas(fname)
+
+    outlines=synthetic_outlines(num_pages, num_outlines, outline_depth)
+    outlines_by_page={}
+    for title, page, level in outlines:
+        outlines_by_page.setdefault(page, []).append((title, level))
+
+    for p in range(num_pages):
+        c.drawString(72, 720, 'page %i' % (p+1))
+
+        for i in range(num_annots):
+            y=72+20*i
+            c.linkURL('https://example.org/%i/%i' % (p, i), (72, y, 200, y+15))
+
+        for i, (title, level) in enumerate(outlines_by_page.get(p, [])):
+            key='p%i-%i' % (p, i)
+            c.bookmarkPage(key)
+            c.addOutlineEntry(title, key, level)
+
+        c.showPage()
+
+    for i, page in enumerate(pagelabel_run_starts(num_pages, pagelabel_runs)):
+        c.addPageLabel(page, style='ROMAN_LOWER' if i % 2 == 0 else 'ARABIC')
+
+    c.save()
+
+def synthetic_outlines(num_pages, num_outlines, depth=1):
+    '''
+        list of outline entries [title, page, level]
+
+        level cycles from 0 to depth-1
+    '''
+    outlines=[]
+    for i in range(num_outlines):
+        page=i*num_pages//num_outlines
+        outlines.append(['Section %i' % (i+1), page, i % depth])
+
+    return outlines
+
+def pagelabel_run_starts(num_pages, runs):
+    '''
+        start pages of page label runs
+    '''
+    return [i*num_pages//runs for i in range(runs)]
+
+def mk_corpus(dir_corpus, corpus):
+    '''
+        make files in a corpus, a pdf and an outline text file
+
+        pdf is reused if made before with same parameters,
+            whose hash is in the file name
+
+        return names of the two files
+    '''
+    if not os.path.exists(dir_corpus):
+        os.makedirs(dir_corpus)
+
+    params=dict(corpus)
+    name=params.pop('name')
+
+    h=hash_bytes(json.dumps(params, sort_keys=True).encode())[:12]
+    pdfname=os.path.join(dir_corpus, '%s-%s.pdf' % (name, h))
+    foutline=os.path.join(dir_corpus, '%s-outline.txt' % name)
+
+    if not os.path.exists(pdfname):
+        mkpdf_synthetic(pdfname, **params)
+
+    # page numbers in text are counted after head pages
+    with open(foutline, 'w') as f:
+        outlines=synthetic_outlines(params['num_pages']-num_headpage,
+                                    params['num_outlines'], params['outline_depth'])
+        for title, page, level in outlines:
+            f.write('%s %iL%i\n' % (title, page+1, level))
+
+    return pdfname, foutline
+
+# cases
+num_headpage=2   # number of head pages in editing
+
+def case_copy_pdf(pdfname, foutline, fout):
+    copy_pdf(pdfname, fout)
+
+def case_merge_pdfs(pdfname, foutline, fout):
+    merge_pdfs([pdfname, pdfname], fout, keep_outlines=True, keep_pagelabels=True)
+
+def case_pdf_edit_headlabel_outline(pdfname, foutline, fout):
+    pdf_edit_headlabel_outline(pdfname, fout, num_headpage=num_headpage, foutline=foutline)
+
+def case_get_outlines_from_pdf(pdfname, foutline, fout):
+    get_outlines_from_pdf(pdfname)
+
+cases_default={
+    'copy_pdf': case_copy_pdf,
+    'merge_pdfs': case_merge_pdfs,
+    'pdf_edit_headlabel_outline': case_pdf_edit_headlabel_outline,
+    'get_outlines_from_pdf': case_get_outlines_from_pdf,
+}
+
+# run
+def run_case(name, pdfname, foutline, fout, repeat=3):
+    '''
+        run a case in a new process for `repeat` times
+
+        return min wall time in second and peak RSS in KB
+    '''
+    ctx=multiprocessing.get_context('spawn')
+
+    walls=[]
+    rss=0
+    for _ in range(repeat):
+        with ctx.Pool(1) as pool:
+            wall, r=pool.apply(_run_case_in_child, (name, pdfname, foutline, fout))
+
+        walls.append(wall)
+        rss=max(rss, r)
+
+    return min(walls), rss
+
+def _run_case_in_child(name, pdfname, foutline, fout):
+    '''
+        run a case with output to stdout dropped
+    '''
+    func=cases_default[name]
+
+    stdout=sys.stdout
+    sys.stdout=open(os.devnull, 'w')
+    try:
+        t0=time.perf_counter()
+        func(pdfname, foutline, fout)
+        wall=time.perf_counter()-t0
+    finally:
+        sys.stdout.close()
+        sys.stdout=stdout
+
+    rss=resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+    return wall, rss
+
+def run_benchmarks(dir_corpus='bench_corpus', corpus=None, cases=None, repeat=3):
+    '''
+        run benchmarks for all cases in all corpus
+
+        return results, a dict
+    '''
+    if corpus is None:
+        corpus=corpus_default
+
+    if cases is None:
+        cases=list(cases_default)
+
+    results=[]
+    for cps in corpus:
+        pdfname, foutline=mk_corpus(dir_corpus, cps)
+        fout=os.path.join(dir_corpus, 'out.pdf')
+
+        for name in cases:
+            wall, rss=run_case(name, pdfname, foutline, fout, repeat=repeat)
+            print('%-30s %-8s %10.3fs %10i KB' % (name, cps['name'], wall, rss))
+
+            results.append(dict(case=name, corpus=cps, repeat=repeat,
+                                wall=wall, peak_rss_kb=rss))
+
+    meta=dict(time=time.strftime('%Y-%m-%d %H:%M:%S'),
+              python=platform.python_version(),
+              PyPDF2=PyPDF2.__version__,
+              platform=platform.platform())
+
+    return dict(meta=meta, results=results)
+
+# scaling of outline conversions
+outline_scaling_sizes=[10**4, 10**5, 10**6]
+
+def run_outline_scaling(sizes=None, depths=(4, None), repeat=3):
+    '''
+        time conversions between level and nest outlines for growing sizes
+
+        time per entry should be roughly constant, since they are linear time
+            see `check_outline_scaling`
+
+        garbage collection is disabled in timing, as done in `timeit`,
+            and min time of `repeat` runs is used
+
+        Parameters:
+            depths: list of int or None
+                max depth of outlines
+                None for a chain, that is level of i-th entry is i
+
+        return list of results
+    '''
+    if sizes is None:
+        sizes=outline_scaling_sizes
+
+    results=[]
+    for n in sizes:
+        for depth in depths:
+            outlines=synthetic_outlines(n, n, n if depth is None else depth)
+
+            to_nest=to_level=float('inf')
+            for _ in range(repeat):
+                gc.disable()
+                try:
+                    t0=time.perf_counter()
+                    nest=outline_level_to_nest(outlines)
+                    t1=time.perf_counter()
+                    levels=outline_nest_to_level(nest)
+                    t2=time.perf_counter()
+                finally:
+                    gc.enable()
+
+                assert levels==outlines
+
+                to_nest=min(to_nest, t1-t0)
+                to_level=min(to_level, t2-t1)
+                del nest, levels
+
+            print('%-30s %-8s %10.3fus %10.3fus' % ('outline scaling n=%i' % n,
+                    'chain' if depth is None else 'depth=%i' % depth,
+                    to_nest/n*1e6, to_level/n*1e6))
+
+            results.append(dict(size=n, depth=depth, to_nest=to_nest, to_level=to_level))
+
+    return results
+
+def check_outline_scaling(results, max_ratio=4):
+    '''
+        check time per entry in outline conversions stays bounded with size
+
+        for each depth, time per entry of every size is compared with the smallest size
+            a quadratic conversion would give a ratio of 100 from 1e4 to 1e6
+
+        return list of failures, (size, depth, key, ratio)
+    '''
+    smallest={}
+    for r in results:
+        if r['depth'] not in smallest or r['size']<smallest[r['depth']]['size']:
+            smallest[r['depth']]=r
+
+    failures=[]
+    for r in results:
+        b=smallest[r['depth']]
+        for key in ['to_nest', 'to_level']:
+            ratio=(r[key]/r['size'])/(b[key]/b['size'])
+            if ratio>max_ratio:
+                failures.append((r['size'], r['depth'], key, ratio))
+
+    return failures
+
+# results
+def save_results(fname, results):
+    with open(fname, 'w') as f:
+        json.dump(results, f, indent=1)
+
+def load_results(fname):
+    with open(fname) as f:
+        return json.load(f)
+
+def compare_results(results, baseline, tolerance=0.2):
+    '''
+        compare results with baseline
+
+        a case is taken as a regression
+            if wall time or peak RSS exceeds baseline by fraction `tolerance`
+
+        return list of regressions, (case, corpus name, key, value, baseline value)
+    '''
+    key=lambda r: (r['case'], r['corpus']['name'])
+    base={key(r): r for r in baseline['results']}
+
+    regressions=[]
+    for r in results['results']:
+        k=key(r)
+        if k not in base:
+            continue
+
+        b=base[k]
+        if b['corpus']!=r['corpus']:
+            print('corpus changed for %s %s, skip' % k)
+            continue
+
+        for name in ['wall', 'peak_rss_kb']:
+            ratio=r[name]/b[name]
+            print('%-30s %-8s %-12s %6.2fx' % (*k, name, ratio))
+
+            if ratio>1+tolerance:
+                regressions.append((*k, name, r[name], b[name]))
+
+    return regressions
+
+# command line
+def main(argv=None):
+    parser=argparse.ArgumentParser(description='benchmarks for PDF pipeline')
+    parser.add_argument('-o', '--output', default='bench_results.json',
+                        help='JSON file to write results to')
+    parser.add_argument('-b', '--baseline', default=None,
+                        help='JSON file of baseline results to compare with')
+    parser.add_argument('-d', '--dir-corpus', default='bench_corpus',
+                        help='directory of synthetic corpus')
+    parser.add_argument('-c', '--corpus', nargs='*', default=None,
+                        help='names of corpus to run')
+    parser.add_argument('--case', nargs='*', default=None,
+                        help='names of cases to run')
+    parser.add_argument('-n', '--repeat', type=int, default=3)
+    parser.add_argument('-t', '--tolerance', type=float, default=0.2)
+    parser.add_argument('--outline-scaling', action='store_true',
+                        help='also time outline conversions up to a million entries')
+    parser.add_argument('--outline-scaling-only', action='store_true',
+                        help='only run the outline scaling check, without corpus')
+    parser.add_argument('--max-ratio', type=float, default=4,
+                        help='max ratio of time per entry in outline scaling, '
+                             'relative to the smallest size')
+
+    args=parser.parse_args(argv)
+
+    if args.outline_scaling_only:
+        results=dict(outline_scaling=run_outline_scaling())
+        save_results(args.output, results)
+
+        return report_outline_scaling(results['outline_scaling'], args.max_ratio)
+
+    corpus=corpus_default
+    if args.corpus is not None:
+        corpus=[c for c in corpus if c['name'] in args.corpus]
+
+    results=run_benchmarks(args.dir_corpus, corpus=corpus, cases=args.case,
+                           repeat=args.repeat)
+
+    failed=0
+    if args.outline_scaling:
+        results['outline_scaling']=run_outline_scaling()
+        failed=report_outline_scaling(results['outline_scaling'], args.max_ratio)
+
+    save_results(args.output, results)
+
+    if args.baseline is not None:
+        regressions=compare_results(results, load_results(args.baseline),
+                                    tolerance=args.tolerance)
+        for r in regressions:
+            print('regression: %s %s %s: %s > %s' % r)
+
+        if regressions:
+            return 1
+
+    return failed
+
+def report_outline_scaling(results, max_ratio):
+    '''
+        print failures in outline scaling
+
+        return 1 if any, otherwise 0
+    '''
+    failures=check_outline_scaling(results, max_ratio=max_ratio)
+    for size, depth, key, ratio in failures:
+        print('outline scaling not linear: n=%i depth=%s %s %.2fx' % (size, depth, key, ratio))
+
+    return 1 if failures else 0
+
+if __name__=='__main__':
+    sys.exit(main())
@@ -0,0 +1,194 @@
+#!/usr/bin/env python3
+
+'''
+class to handle on-disk cache
+
+each entry is a file in a cache directory, named by its key
+    entries are evicted in LRU order when total size exceeds a limit
+'''
+
+import os
+import hashlib
+
+class DirCache:
+    '''
+        cache of bytes in a directory
+
+        last access of an entry is recorded by mtime of its file
+    '''
+    def __init__(self, dirname, max_size=2**30, suffix='.bin'):
+        '''
+            Parameters:
+                max_size: int
+                    max total size of entries in bytes
+
+                suffix: str
+                    suffix of entry file
+        '''
+        self.dirname=dirname
+        self.max_size=max_size
+        self.suffix=suffix
+
+        if not os.path.exists(dirname):
+            os.makedirs(dirname)
+
+        self._size=None  # estimate of total size, scanned in first put
+
+    def path_of(self, key):
+        '''
+            file name for a key
+        '''
+        return os.path.join(self.dirname, key+self.suffix)
+
+    # get/put
+    def get(self, key):
+        '''
+            return bytes stored for key, or None if not cached
+        '''
+        fname=self.path_of(key)
+        try:
+            with open(fname, 'rb') as f:
+                data=f.read()
+        except FileNotFoundError:
+            return None
+
+        os.utime(fname)   # mark as recently used
+
+        return data
+
+    def put(self, key, data):
+        '''
+            store bytes for a key
+
+            file is written to a temporary name first,
+                so that other processes never read a partial entry
+        '''
+        fname=self.path_of(key)
+
+        tmp='%s.%i.tmp' % (fname, os.getpid())
+        with open(tmp, 'wb') as f:
+            f.write(data)
+        os.replace(tmp, fname)
+
+        if self._size is None:
+            self._size=self.total_size()
+        else:
+            self._size+=len(data)
+
+        if self._size>self.max_size:
+            self.evict()
+
+    # remove
+    def remove(self, key):
+        '''
+            remove entry of a key if existed
+        '''
+        fname=self.path_of(key)
+        if os.path.exists(fname):
+            os.remove(fname)
+
+    def clear(self):
+        '''
+            remove all entries
+        '''
+        for _, _, fname in self.list_entries():
+            os.remove(fname)
+
+        self._size=0
+
+    def evict(self, max_size=None):
+        '''
+            remove least recently used entries
+                until total size is not larger than `max_size`
+
+            return number of entries removed
+        '''
+        if max_size is None:
+            max_size=self.max_size
+
+        entries=sorted(self.list_entries())
+        total=sum([s for _, s, _ in entries])
+
+        n=0
+        for _, size, fname in entries:
+            if total<=max_size:
+                break
+
+            try:
+                os.remove(fname)
+            except FileNotFoundError:  # removed by other process
+                pass
+
+            total-=size
+            n+=1
+
+        self._size=total
+
+        return n
+
+    # entries
+    def list_entries(self):
+        '''
+            list entries as (mtime, size, file name)
+        '''
+        entries=[]
+        for name in os.listdir(self.dirname):
+            if not name.endswith(self.suffix):
+                continue
+
+            fname=os.path.join(self.dirname, name)
+            try:
+                st=os.stat(fname)
+            except FileNotFoundError:
+                continue
+
+            entries.append((st.st_mtime, st.st_size, fname))
+
+        return entries
+
+    def total_size(self):
+        '''
+            total size of entries
+        '''
+        return sum([s for _, s, _ in self.list_entries()])
+
+# hash functions
+def hash_bytes(*chunks):
+    '''
+        hex digest of a sequence of bytes
+    '''
+    h=hashlib.sha1()
+    for c in chunks:
+        h.update(c)
+
+    return h.hexdigest()
+
+def hash_file(fname, blocksize=2**20):
+    '''
+        hex digest of content in a file
+    '''
+    h=hashlib.sha1()
+    with open(fname, 'rb') as f:
+        for block in iter(lambda: f.read(blocksize), b''):
+            h.update(block)
+
+    return h.hexdigest()
+
+def file_fingerprint(fname, blocksize=2**20):
+    '''
+        quick fingerprint of a file
+
+        made from file size and content of head and tail blocks,
+            so that it is cheap even for a large file
+    '''
+    size=os.path.getsize(fname)
+
+    h=hashlib.sha1(str(size).encode())
+    with open(fname, 'rb') as f:
+        h.update(f.read(blocksize))
+
+        if size>blocksize:
+            f.seek(max(blocksize, size-blocksize))
+            h.update(f.read(blocksize))
+
+    return h.hexdigest()
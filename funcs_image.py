@@ -11,9 +11,14 @@ two libraries used: fitz and reportlab
 
 import os
 
-from io import BytesIO
 import re
 
+import queue
+import threading
+import multiprocessing
+
+import numpy as np
+
 from PIL import Image
 
 import fitz
@@ -23,6 +28,11 @@ from reportlab.lib.utils import ImageReader
 
 from .funcs_path import ext_elements_by_range, list_files_by_range_fmt
 from .funcs_page import get_pagesize_by_name
+from .funcs_manifest import (load_manifest, save_manifest, set_manifest_source,
+                             record_file, is_file_fresh, get_file_checksum)
+from .cache import file_fingerprint
+from .funcs_trace import traced, span, count
+from .funcs_progress import get_progress
 
 # convert page to PIL Image
 def page_to_image(page, write_to_file=None, **kwargs):
@@ -36,14 +46,17 @@ def page_to_image(page, write_to_file=None, **kwargs):
     '''
     pix=page_to_pixmap(page, **kwargs)
 
-    png=pix.getPNGData()
-
     if write_to_file:
-        with open(write_to_file, 'wb') as f:
-            f.write(png)
+        write_pixmap_to_file(pix, write_to_file)
         return
-    
-    return Image.open(BytesIO(png))
+
+    return pixmap_to_image(pix)
+
+def page_to_array(page, **kwargs):
+    '''
+        convert page to numpy array with shape (height, width, channels)
+    '''
+    return pixmap_to_array(page_to_pixmap(page, **kwargs))
 
 def page_to_pixmap(page, zoomxy=2, alpha=False):
     '''
@@ -59,52 +72,268 @@ def page_to_pixmap(page, zoomxy=2, alpha=False):
 
     return page.getPixmap(matrix=mat, alpha=alpha)
 
+## pixmap conversion
+_pixmap_modes={1: 'L', 2: 'LA', 3: 'RGB', 4: 'RGBA'}  # mode by number of channels
+
+def pixmap_to_image(pix):
+    '''
+        convert pixel map to PIL image
+
+        built on raw samples of pixmap, without encoding to PNG
+    '''
+    mode=_pixmap_modes[pix.n]
+    return Image.frombuffer(mode, (pix.width, pix.height), pix.samples,
+                                  'raw', mode, pix.stride, 1)
+
+def pixmap_to_array(pix):
+    '''
+        view of pixel map as numpy array with shape (height, width, channels)
+
+        samples are copied once from pixmap to the array
+    '''
+    a=np.frombuffer(pix.samples, dtype=np.uint8)
+    a=a.reshape(pix.height, pix.stride)[:, :pix.width*pix.n]
+
+    return a.reshape(pix.height, pix.width, pix.n)
+
+def write_pixmap_to_file(pix, fname):
+    '''
+        write pixel map to a PNG file
+    '''
+    png=pix.getPNGData()
+    with open(fname, 'wb') as f:
+        f.write(png)
+
 # fitz page
-def yield_fitz_pages_from_pdf(pdfname, page_range=None):
+def yield_fitz_pages_from_pdf(pdfname, page_range=None, pageids=None):
     '''
         return page number and page
 
         page_range must be given with `one_started` and `keep_end`
 
+        `pageids`: None or list of int
+            if given, yield these pages, instead of `page_range`
+
         yield page id, page
             where id starts from 1
     '''
     pdf=fitz.open(pdfname)
 
-    pages=range(len(pdf))
+    if pageids is None:
+        pageids=get_pageids_of_pdf(pdf, page_range=page_range)
+
+    for p in pageids:
+        yield p, pdf[p-1]
+
+def get_pageids_of_pdf(pdf, page_range=None):
+    '''
+        list of page ids in a pdf, which start from 1
+
+        `pdf` could be a file name or a fitz document
+
+        page_range must be given with `one_started` and `keep_end`
+    '''
+    if type(pdf) is str:
+        with fitz.open(pdf) as doc:
+            nump=len(doc)
+    else:
+        nump=len(pdf)
+
+    pages=range(nump)
 
     if page_range is not None:
         pages=ext_elements_by_range(pages, page_range, keep_end=True, one_started=True)
 
-    for p in pages:
-        yield p+1, pdf[p]
+    return [p+1 for p in pages]
+
+## render pages in background
+def yield_arrays_from_pdf(pdfname, page_range=None, pageids=None, queue_size=4,
+                            dir_image=None, fname_format='page-%i.png', **kwargs):
+    '''
+        yield page id and numpy array of pages in a PDF
+
+        pages are rendered in a background thread
+            and passed through a queue with max size `queue_size`,
+                so that rendering is overlapped with the consumer
+
+        Parameters:
+            pageids: None or list of int
+                see `yield_fitz_pages_from_pdf`
+
+            dir_image: None or str
+                if given, also write pages to image files in this directory
+                    named by `fname_format`
+                otherwise, no file is written
+
+            optional keyword arguments for `page_to_pixmap`:
+                zoomxy, alpha
+    '''
+    if dir_image is not None and not os.path.exists(dir_image):
+        os.mkdir(dir_image)
+
+    q=queue.Queue(maxsize=queue_size)
+    stop=threading.Event()  # set when consumer exits
+
+    def put(item):
+        while not stop.is_set():
+            try:
+                q.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def render():
+        try:
+            for pageid, page in yield_fitz_pages_from_pdf(pdfname, page_range=page_range,
+                                                                   pageids=pageids):
+                pix=page_to_pixmap(page, **kwargs)
+
+                if dir_image is not None:
+                    write_pixmap_to_file(pix, os.path.join(dir_image, fname_format % pageid))
+
+                if not put((pageid, pixmap_to_array(pix))):
+                    return
+        except BaseException as e:
+            put(e)
+        finally:
+            put(None)   # end of pages
+
+    thread=threading.Thread(target=render, daemon=True)
+    thread.start()
+
+    try:
+        while True:
+            item=q.get()
+            if item is None:
+                break
+
+            if isinstance(item, BaseException):
+                raise item
+
+            yield item
+    finally:
+        stop.set()
+        thread.join()
 
 # write functions
-def write_page_to_file(page, fname):
-    page_to_image(page, write_to_file=fname)
+def write_page_to_file(page, fname, **kwargs):
+    page_to_image(page, write_to_file=fname, **kwargs)
 
+@traced
 def write_pdf_to_dir_image(pdfname, dir_image='pages',
-                            fname_format='page-%i.png', page_range=None):
+                            fname_format='page-%i.png', page_range=None,
+                            nproc=1, chunksize=None, incremental=False,
+                            progress=None, **kwargs):
     '''
         extract pages in a PDF to a directory
+
+        Parameters:
+            progress: progress report of pages rendered
+                see `funcs_progress` for detail
+
+            nproc: int or None
+                number of processes to render pages
+                if None, use number of cpus
+                if 1, render in current process
+
+            chunksize: None or int
+                number of pages rendered by a worker in one task
+                if None, pages are split to about 4 chunks per process
+
+            incremental: bool
+                if True, only render pages missing or stale
+                    according to manifest in `dir_image`
+                        see `funcs_manifest` for detail
+
+            optional keyword arguments for `page_to_pixmap`:
+                zoomxy, alpha
     '''
     if not os.path.exists(dir_image):
         os.mkdir(dir_image)
 
-    # format for image file name
-    f=lambda p, fmt=fname_format: fmt % p
+    if nproc is None:
+        nproc=os.cpu_count()
+
+    pageids=get_pageids_of_pdf(pdfname, page_range=page_range)
+
+    # manifest
+    if incremental:
+        manifest=load_manifest(dir_image)
+        set_manifest_source(manifest, file_fingerprint(pdfname))
+
+        params=dict(zoom=kwargs.get('zoomxy', 2), alpha=kwargs.get('alpha', False))
+
+        pageids=[p for p in pageids
+                    if not is_file_fresh(dir_image, manifest, fname_format % p,
+                                         page=p, **params)]
+        print('%i pages to render' % len(pageids))
+
+    # render
+    prog=get_progress(progress, total=len(pageids), desc='render %s' % pdfname)
+    if nproc>1:
+        chunks=split_to_chunks(pageids, nproc, chunksize=chunksize)
+
+        tasks=[(pdfname, c, dir_image, fname_format, kwargs) for c in chunks]
+        with multiprocessing.Pool(nproc) as pool:
+            for fnames in pool.imap_unordered(_write_pages_chunk, tasks):
+                count('pages rendered', len(fnames))
+                prog.update(len(fnames))
+    else:
+        for pageid, page in yield_fitz_pages_from_pdf(pdfname, pageids=pageids):
+            fname=os.path.join(dir_image, fname_format % pageid)
+
+            with span('render', page=pageid):
+                write_page_to_file(page, fname, **kwargs)
+            count('pages rendered')
+            prog.update()
+
+    if incremental:
+        for p in pageids:
+            record_file(dir_image, manifest, fname_format % p, page=p, **params)
+        save_manifest(dir_image, manifest)
+
+## parallel rendering
+def split_to_chunks(items, nproc, chunksize=None):
+    '''
+        split items to continuing chunks
+
+        if `chunksize` is None, about 4 chunks for each process
+    '''
+    if chunksize is None:
+        chunksize=max(1, -(-len(items)//(4*nproc)))
+
+    return [items[i:i+chunksize] for i in range(0, len(items), chunksize)]
+
+def _write_pages_chunk(task):
+    '''
+        worker to render a chunk of pages
+
+        each worker opens its own fitz document
+
+        return list of file names written
+    '''
+    pdfname, pageids, dir_image, fname_format, kwargs=task
+
+    fnames=[]
+    with fitz.open(pdfname) as pdf:
+        for p in pageids:
+            fname=os.path.join(dir_image, fname_format % p)
+            write_page_to_file(pdf[p-1], fname, **kwargs)
 
-    for pageid, page in yield_fitz_pages_from_pdf(pdfname, page_range=page_range):
-        fname=os.path.join(dir_image, f(pageid))
-        print('write to %s' % fname)
+            fnames.append(fname)
 
-        write_page_to_file(page, fname)
+    return fnames
 
 # create pdf from images or other pdf
-def mkpdf_from_images(pdf_out, images, pagesize='a4', pagescale=None, **kwargs):
+def mkpdf_from_images(pdf_out, images, pagesize='a4', pagescale=None,
+                        progress=None, **kwargs):
     '''
         make pdf from pages
 
+        `progress`: progress report of pages added
+            see `funcs_progress` for detail
+
         optional keyword arguments:
             page_range
             fname_format
@@ -113,15 +342,13 @@ def mkpdf_from_images(pdf_out, images, pagesize='a4', pagescale=None, **kwargs):
 
     c=canvas.Canvas(pdf_out, pagesize=pagesize)
 
-    for i, p in enumerate(yield_images(images, **kwargs)):
-        if type(p) is str:
-            print('add page %i: %s' % (i+1, p))
-        else:
-            print('add page', i+1)
-
+    total=len(images) if isinstance(images, (list, tuple)) else None
+    prog=get_progress(progress, total=total, desc='make %s' % pdf_out)
+    for p in yield_images(images, **kwargs):
         add_image_page(c, p)
 
         c.showPage()
+        prog.update()
 
     c.save()
 
@@ -233,12 +460,17 @@ def crop_image(img, left=0, right=1, lower=0, upper=1):
 
 def split_images_horizontal(dir_images, page_range=None, dir_out=None,
                 prefix_fmt='page-%i', prefix_out_fmt='crop-%i', fig_suffix='.png',
-                sep=0.5, ncrop_starts=1):
+                sep=0.5, ncrop_starts=1, incremental=False, progress=None):
     '''
         split each page in a directory `dir_images` within in range `page_range`
             into 2 parts in horizontal direction
                 of which fraction is given by `sep`
                     that means two parts are (0, sep) and (sep 1)
+
+        if `incremental`, skip pages whose crops are fresh in manifest of `dir_out`
+
+        `progress`: progress report of pages split
+            see `funcs_progress` for detail
     '''
     if dir_out is None:
         dir_out=dir_images
@@ -249,17 +481,45 @@ def split_images_horizontal(dir_images, page_range=None, dir_out=None,
     fnames=list_files_by_range_fmt(dir_images, page_range=page_range,
                     fname_format=(prefix_fmt+fig_suffix))
 
+    if incremental:
+        manifest_in=load_manifest(dir_images)
+        manifest=load_manifest(dir_out)
+
+    prog=get_progress(progress, total=len(fnames), desc='split %s' % dir_images)
+
     ncrop=ncrop_starts
     for fname in fnames:
-        print('split %s ==> crop %i, %i' % (fname, ncrop, ncrop+1))
+        outnames=[(prefix_out_fmt % n)+fig_suffix for n in [ncrop, ncrop+1]]
+
+        if incremental:
+            name=os.path.basename(fname)
+            checksum=get_file_checksum(dir_images, manifest_in, name)
+            params=[dict(input=name, input_checksum=checksum, sep=sep, part=i)
+                        for i in range(2)]
+
+            if all([is_file_fresh(dir_out, manifest, n, **kw)
+                        for n, kw in zip(outnames, params)]):
+                ncrop+=2
+                prog.update()
+                continue
+
         img=Image.open(fname)
 
-        outfname=os.path.join(dir_out,  (prefix_out_fmt  % ncrop)+fig_suffix)
+        outfname=os.path.join(dir_out,  outnames[0])
         crop=crop_image(img, right=sep)
         crop.save(outfname)
         ncrop+=1
 
-        outfname=os.path.join(dir_out,  (prefix_out_fmt  % ncrop)+fig_suffix)
+        outfname=os.path.join(dir_out,  outnames[1])
         crop=crop_image(img, left=sep)
         crop.save(outfname)
         ncrop+=1
+
+        if incremental:
+            for n, kw in zip(outnames, params):
+                record_file(dir_out, manifest, n, **kw)
+
+        prog.update()
+
+    if incremental:
+        save_manifest(dir_out, manifest)
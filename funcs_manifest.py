@@ -0,0 +1,104 @@
+#!/usr/bin/env python3
+
+'''
+Functions for manifest of files exported to a directory
+
+manifest is a JSON file, `manifest.json`, in the directory, which records
+    source: fingerprint of the source, e.g. PDF file
+    files: map from file name to a record, e.g.
+        {'page': 1, 'zoom': 2, 'checksum': ..., 'size': ..., 'mtime': ...}
+
+a file is fresh if it is not changed since recorded
+    and its record has the same parameters as required
+'''
+
+import os
+import json
+
+from .cache import hash_file
+
+_manifest_name='manifest.json'
+
+# load/save
+def load_manifest(dirname):
+    '''
+        load manifest in a directory
+
+        if not existed, return an empty manifest
+    '''
+    fname=os.path.join(dirname, _manifest_name)
+    if not os.path.exists(fname):
+        return {'source': None, 'files': {}}
+
+    with open(fname) as f:
+        return json.load(f)
+
+def save_manifest(dirname, manifest):
+    '''
+        save manifest to a directory
+    '''
+    fname=os.path.join(dirname, _manifest_name)
+
+    tmp=fname+'.tmp'
+    with open(tmp, 'w') as f:
+        json.dump(manifest, f, indent=1)
+    os.replace(tmp, fname)
+
+def set_manifest_source(manifest, source):
+    '''
+        set fingerprint of source
+
+        all records are dropped if source is changed
+    '''
+    if manifest['source']!=source:
+        manifest['source']=source
+        manifest['files']={}
+
+# records of files
+def record_file(dirname, manifest, name, **params):
+    '''
+        record a file in manifest, with parameters to produce it
+
+        `name` is the file name in the directory
+    '''
+    fname=os.path.join(dirname, name)
+    st=os.stat(fname)
+
+    record=dict(params)
+    record.update(checksum=hash_file(fname), size=st.st_size, mtime=st.st_mtime)
+
+    manifest['files'][name]=record
+
+def is_file_fresh(dirname, manifest, name, **params):
+    '''
+        whether a file is fresh
+            that is existed, not changed since recorded, and produced by `params`
+    '''
+    record=manifest['files'].get(name)
+    if record is None:
+        return False
+
+    for k, v in params.items():
+        if record.get(k)!=v:
+            return False
+
+    return get_file_checksum(dirname, manifest, name)==record['checksum']
+
+def get_file_checksum(dirname, manifest, name):
+    '''
+        checksum of a file
+
+        use the one recorded in manifest if size and mtime are not changed
+        return None if file not existed
+    '''
+    fname=os.path.join(dirname, name)
+    if not os.path.exists(fname):
+        return None
+
+    record=manifest['files'].get(name)
+    if record is not None:
+        st=os.stat(fname)
+        if st.st_size==record['size'] and st.st_mtime==record['mtime']:
+            return record['checksum']
+
+    return hash_file(fname)
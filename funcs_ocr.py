@@ -7,64 +7,670 @@ functions for image ocr
 import os
 
 import re
+import json
 import numbers
+import itertools
+import collections
+import multiprocessing
 
+import numpy as np
+
+import cnocr
 from cnocr import CnOcr
+from cnocr.utils import read_img
 
-from .funcs_path import list_files_by_range_fmt
+from .funcs_path import list_files_in_dir, list_files_by_range_fmt
+from .funcs_image import yield_arrays_from_pdf, get_pageids_of_pdf
+from .cache import DirCache, hash_bytes, hash_file
+from .funcs_manifest import load_manifest, get_file_checksum
+from .funcs_trace import traced, span, count
+from .funcs_progress import get_progress
 
 _cnocr=None    # a global ocr
-def ocr_image(fname, score=None, lang='en'):
-    print('OCR %s' % fname)
+_cnocr_kwargs=dict(det_model_name='naive_det')   # configure of model
+def get_cnocr():
+    '''
+        get the global ocr model
 
+        load it in first call
+    '''
     global _cnocr
     if _cnocr is None:
         # if lang=='en':
         #     _cnocr=CnOcr(det_model_name='naive_det', rec_model_name='en_PP-OCRv3')
         # else:
-        _cnocr=CnOcr(det_model_name='naive_det')
+        _cnocr=CnOcr(**_cnocr_kwargs)
+
+    return _cnocr
+
+def ocr_image(fname, score=None, lang='en', cache=None):
+    '''
+        ocr an image
+
+        `fname` could be a file name or an array of shape (height, width, 3)
+
+        Parameters:
+            score: None or float
+                lines with score lower than it are skipped
+
+            cache: None, str or `DirCache`
+                cache of raw lines returned by model
+                    if str, it is the cache directory
+                if hit, no inference is done
+                    and lines are only re-filtered by `score`
+    '''
+    cache=get_ocr_cache(cache)
+    if cache is not None:
+        key=ocr_cache_key(fname, mode='ocr')
+        lines=load_ocr_cache(cache, key)
+
+        if lines is not None:
+            count('ocr cache hits')
+            return ocr_lines_to_text(lines, score=score)
+
+    ocr=get_cnocr()
+    with span('inference', fname=fname if type(fname) is str else None):
+        lines=ocr.ocr(fname)
+    count('pages ocr')
+
+    if cache is not None:
+        save_ocr_cache(cache, key, lines)
     
     # text='\n'.join([''.join(data['text']) for data in res])
-    lines=[]
-    for data in _cnocr.ocr(fname):
+    return ocr_lines_to_text(lines, score=score)
+
+def ocr_lines_to_text(lines, score=None):
+    '''
+        join text of lines returned by `CnOcr`
+
+        lines with score lower than `score` are skipped
+    '''
+    texts=[]
+    for data in lines:
         if score is not None and data['score']<score:
             # skip text of too low score
             continue
 
-        lines.append(data['text'])
+        texts.append(data['text'])
+
+    return '\n'.join(texts)
+
+# cache of ocr results
+def get_ocr_cache(cache):
+    '''
+        cache for ocr results
+
+        `cache` could be None, a directory name or `DirCache`
+    '''
+    if cache is None or isinstance(cache, DirCache):
+        return cache
+
+    return DirCache(cache, suffix='.json')
+
+def ocr_cache_key(img, mode='ocr'):
+    '''
+        key of ocr results for an image
+
+        made from hash of image content, configure of model and `mode`
+
+        Parameters:
+            mode: 'ocr' or 'batch'
+                path giving the results
+                    'ocr' for `CnOcr.ocr` in `ocr_image`
+                    'batch' for detection and batched recognition
+                        in `yield_ocr_texts_batch`
+                results from two paths may differ slightly, so not shared
+    '''
+    if type(img) is str:
+        h=hash_file(img)
+    else:
+        # numpy array
+        h=hash_bytes(str(img.shape).encode(), img.tobytes())
+
+    config='%s %s %s' % (cnocr.__version__, sorted(_cnocr_kwargs.items()), mode)
+
+    return hash_bytes(h.encode(), config.encode())
+
+def load_ocr_cache(cache, key):
+    '''
+        load lines from cache
+
+        return None if not cached
+    '''
+    data=cache.get(key)
+    if data is None:
+        return None
+
+    return json.loads(data.decode())
+
+def save_ocr_cache(cache, key, lines):
+    '''
+        save raw lines returned by `CnOcr` to cache
+
+        only text and score of each line are kept
+    '''
+    lines=[{'text': d['text'], 'score': float(d['score'])} for d in lines]
+    cache.put(key, json.dumps(lines).encode())
+
+# batched ocr
+def yield_ocr_texts_batch(images, batch_size=32, score=None, cache=None):
+    '''
+        ocr a list of images in batch
+
+        text lines are detected page by page,
+            and then recognized in batches of fixed size,
+                which could collect lines from many pages
+
+        images are preprocessed same as `CnOcr.ocr`, see `ocr_detect_lines`
+            but lines padded to the widest in a batch in recognition,
+                scores could differ slightly from `ocr_image`
+
+        yield text of each image, in the order of `images`
+
+        `cache`: see `ocr_image` for detail
+    '''
+    ocr=get_cnocr()
+    cache=get_ocr_cache(cache)
 
-    text='\n'.join(lines)
+    pending=collections.deque()  # (key, results of lines) for unfinished pages
+    crops=[]    # (results, index, cropped image) waiting for recognition
+    for img in images:
+        key=results=None
+        if cache is not None:
+            key=ocr_cache_key(img, mode='batch')
+            results=load_ocr_cache(cache, key)
+
+        if results is None:
+            with span('detect'):
+                boxes=ocr_detect_lines(ocr, img)
+
+            results=[None]*len(boxes)
+            for i, box in enumerate(boxes):
+                crops.append((results, i, box['cropped_img']))
+        else:
+            key=None    # no need to save again
+            count('ocr cache hits')
+
+        pending.append((key, results))
+
+        while len(crops)>=batch_size:
+            ocr_recognize_crops(ocr, crops[:batch_size])
+            del crops[:batch_size]
+
+        # lines are recognized in order, so a page is finished if its last line is
+        while pending and (not pending[0][1] or pending[0][1][-1] is not None):
+            yield _pop_finished_page(pending, cache, score)
+
+    if crops:
+        ocr_recognize_crops(ocr, crops)
+
+    while pending:
+        yield _pop_finished_page(pending, cache, score)
+
+def _pop_finished_page(pending, cache, score):
+    '''
+        pop the first finished page in `pending`
+
+        return its text, and save lines to cache if needed
+    '''
+    key, lines=pending.popleft()
+    count('pages ocr')
+
+    if key is not None:
+        save_ocr_cache(cache, key, lines)
+
+    return ocr_lines_to_text(lines, score=score)
+
+def ocr_detect_lines(ocr, img):
+    '''
+        detect text lines in an image
+
+        image is preprocessed as in `CnOcr.ocr`:
+            gray image expanded to 3 channels
+            too small image gives no line
+            image of dark background is inverted, with white text to black
+
+        `img` could be a file name or an array of shape (height, width, 3)
+
+        return list of dict, with keys `box`, `score`, `cropped_img`
+    '''
+    if type(img) is str:
+        img=read_img(img, gray=False)
+
+    img=np.asarray(img)
+    if img.ndim==2:
+        img=img[..., None]
+    if img.shape[2]==1:
+        img=np.repeat(img, 3, axis=2)
+
+    if min(img.shape[0], img.shape[1])<2:
+        return []
+
+    if img.mean()<145:
+        img=255-img
+
+    return ocr.det_model.detect(img)['detected_texts']
+
+def ocr_recognize_crops(ocr, crops):
+    '''
+        recognize a batch of cropped lines
+
+        `crops` is a list of (results, index, cropped image)
+            `results[index]` is set by the recognized line, a dict with `text` and `score`
+    '''
+    with span('recognize', nlines=len(crops)):
+        outs=ocr.ocr_for_single_lines([c for _, _, c in crops], batch_size=len(crops))
+
+    for (results, i, _), out in zip(crops, outs):
+        results[i]=out
+
+# multi-process ocr
+def yield_ocr_texts_pool(images, nproc=None, chunksize=1, max_inflight=None, **kwargs):
+    '''
+        ocr images in a pool of processes
+
+        each process loads its own model once
+            and ocr chunks of images fed to it
+
+        yield text of each image, in the order of `images`
+
+        Parameters:
+            nproc: None or int
+                number of processes
+                if None, use number of cpus
+
+            chunksize: int
+                number of images in one task sent to a worker
+
+            max_inflight: None or int
+                max number of tasks submitted but not merged yet
+                if None, use 2*nproc
+
+            optional keyword arguments:
+                score, batch_size, cache
+                    see `yield_ocr_texts` for detail
+    '''
+    if nproc is None:
+        nproc=os.cpu_count()
+
+    if max_inflight is None:
+        max_inflight=2*nproc
+
+    with multiprocessing.Pool(nproc, initializer=_init_ocr_worker) as pool:
+        inflight=collections.deque()
+
+        for chunk in _iter_chunks(images, chunksize):
+            if len(inflight)>=max_inflight:
+                for text in inflight.popleft().get():
+                    yield text
+
+            inflight.append(pool.apply_async(_ocr_worker, (chunk, kwargs)))
+
+        while inflight:
+            for text in inflight.popleft().get():
+                yield text
+
+def _iter_chunks(items, chunksize):
+    '''
+        split an iterable to lists of `chunksize` items, the last could be shorter
+    '''
+    chunk=[]
+    for item in items:
+        chunk.append(item)
+        if len(chunk)>=chunksize:
+            yield chunk
+            chunk=[]
 
-    return text
+    if chunk:
+        yield chunk
 
-def ocr_images_list(images, fname_out=None):
+def _init_ocr_worker():
+    '''
+        load model in a worker process
+
+        model inherited from parent process is dropped, since it is not safe to share
+    '''
+    global _cnocr
+    _cnocr=None
+
+    get_cnocr()
+
+def _ocr_worker(images, kwargs):
+    '''
+        ocr a chunk of images in a worker
+
+        return list of texts
+    '''
+    return list(yield_ocr_texts(images, **kwargs))
+
+# ocr for multiply of images
+def yield_ocr_texts(images, score=None, batch_size=None, nproc=1, cache=None, **kwargs):
     '''
         ocr a list of images
+
+        yield text of each image in order
+
+        Parameters:
+            batch_size: None or int
+                if None, ocr images one by one
+                otherwise, recognize lines from different images in batches
+                    see `yield_ocr_texts_batch` for detail
+
+            nproc: None or int
+                number of processes
+                if not 1, ocr in a pool of processes
+                    see `yield_ocr_texts_pool` for detail
+
+            cache: None, str or `DirCache`
+                cache of ocr results, see `ocr_image` for detail
+
+            optional keyword arguments:
+                chunksize, max_inflight
+                    only work for `nproc` not 1
+    '''
+    if nproc!=1:
+        texts=yield_ocr_texts_pool(images, nproc=nproc, score=score,
+                                    batch_size=batch_size, cache=cache, **kwargs)
+    elif batch_size is None:
+        cache=get_ocr_cache(cache)
+        texts=(ocr_image(fname, score=score, cache=cache) for fname in images)
+    else:
+        texts=yield_ocr_texts_batch(images, batch_size=batch_size,
+                                    score=score, cache=cache)
+
+    for text in texts:
+        yield text
+
+@traced
+def ocr_images_list(images, fname_out=None, keys=None, resume=False,
+                        page_marker=None, progress=None, **kwargs):
     '''
-    text=''
-    for fname in images:
-        text+=ocr_image(fname)+'\n'
+        ocr a list of images
+
+        if `fname_out` is given,
+            text of each image is appended to it as soon as finished
+                see `OcrTextWriter` for detail
+
+        Parameters:
+            keys: None or list
+                keys to identify images in checkpoint
+                if None, use the file name, or index for image not given by file
+
+            resume: bool
+                whether to skip images already done in previous run
+
+            page_marker: None or str
+                format of line written before text of each image, e.g. '==== %s ===='
+                    formatted with key of image
 
+            progress: progress report of images done
+                see `funcs_progress` for detail
+
+            optional keyword arguments are passed to `yield_ocr_texts`
+                e.g. score, batch_size, nproc
+    '''
     if fname_out is None:
-        return text
+        # iterator of images is streamed, with total unknown
+        total=len(images) if hasattr(images, '__len__') else None
+
+        prog=get_progress(progress, total=total, desc='ocr')
+        return join_ocr_texts(yield_ocr_texts(images, **kwargs), prog)
+
+    # keys are derived lazily, as images consumed
+    if keys is None:
+        pairs=((img if type(img) is str else i, img) for i, img in enumerate(images))
+    else:
+        pairs=zip(keys, images)
+
+    total=None
+    for a in [keys, images]:
+        if hasattr(a, '__len__'):
+            total=len(a)
+            break
+
+    writer=OcrTextWriter(fname_out, page_marker=page_marker)
+    n, pairs=writer.open_pairs(pairs, resume=resume)
+
+    if total is not None:
+        total-=n
+
+    write_ocr_texts(writer, pairs, total=total, progress=progress, **kwargs)
+
+def join_ocr_texts(texts, prog):
+    '''
+        join texts of images, each followed by a new line
+    '''
+    result=[]
+    for t in texts:
+        result.append(t+'\n')
+        prog.update()
+
+    return ''.join(result)
+
+def write_ocr_texts(writer, pairs, total=None, progress=None, **kwargs):
+    '''
+        ocr images and write to an opened `OcrTextWriter`
+
+        `pairs`: iterable of (key, image)
+            consumed lazily, and keys of images in ocr are kept in a queue
+
+        writer is closed at the end
+    '''
+    keys=collections.deque()
+    def iter_images():
+        for key, img in pairs:
+            keys.append(key)
+            yield img
+
+    prog=get_progress(progress, total=total, desc='ocr to %s' % writer.fname)
+    try:
+        for text in yield_ocr_texts(iter_images(), **kwargs):
+            writer.write_page(keys.popleft(), text)
+            prog.update()
+    finally:
+        writer.close()
+
+## writer of ocr text
+class OcrTextWriter:
+    '''
+        write ocr text page by page
+
+        a checkpoint file, with name `fname+'.ckpt'`, is kept along with the output
+            each line of it is [offset, key] in JSON,
+                with `offset` the size of output after the page `key` is written
+    '''
+    def __init__(self, fname, page_marker=None):
+        self.fname=fname
+        self.fname_ckpt=fname+'.ckpt'
 
-    with open(fname_out, 'w') as f:
-        f.write(text)
+        self.page_marker=page_marker
 
-def ocr_images_in_dir(dir_images, fname_out=None):
+        self._f=self._fckpt=None
+
+    def open(self, keys, resume=False):
+        '''
+            open output for the pages given by `keys`
+
+            if `resume`, pages at head of `keys` done in previous run are kept,
+                and the rest in output is truncated
+
+            return number of pages kept
+        '''
+        done=self.load_resumable(resume)
+
+        n=0
+        for (_, k), key in zip(done, keys):
+            if k!=key:
+                break
+            n+=1
+
+        self._open_after(done[:n])
+
+        return n
+
+    def open_pairs(self, pairs, resume=False):
+        '''
+            same as `open`, but for an iterable of (key, image)
+                which is consumed lazily, only as far as pages done
+
+            return number of pages kept, and iterator of pairs left
+        '''
+        done=self.load_resumable(resume)
+
+        pairs=iter(pairs)
+        head=[]
+
+        n=0
+        for _, k in done:
+            pair=next(pairs, None)
+            if pair is None:
+                break
+
+            if pair[0]!=k:
+                head.append(pair)
+                break
+            n+=1
+
+        self._open_after(done[:n])
+
+        return n, itertools.chain(head, pairs)
+
+    def load_resumable(self, resume=False):
+        '''
+            list of [offset, key] done in previous run, if `resume`
+        '''
+        if resume and os.path.exists(self.fname) and os.path.exists(self.fname_ckpt):
+            return self.load_checkpoint()
+
+        return []
+
+    def _open_after(self, done):
+        '''
+            open output, keeping pages `done`, list of [offset, key]
+        '''
+        n=len(done)
+        offset=done[-1][0] if done else 0
+
+        self._f=open(self.fname, 'r+b' if n else 'wb')
+        self._f.truncate(offset)
+        self._f.seek(offset)
+
+        self._fckpt=open(self.fname_ckpt, 'w')
+        for d in done:
+            self._fckpt.write(json.dumps(d)+'\n')
+        self._fckpt.flush()
+
+        if n:
+            print('resume after %i pages done' % n)
+
+    def load_checkpoint(self):
+        '''
+            load list of [offset, key] from checkpoint file
+
+            incomplete line at the tail is ignored
+        '''
+        done=[]
+        with open(self.fname_ckpt) as f:
+            for line in f:
+                try:
+                    done.append(json.loads(line))
+                except ValueError:
+                    break
+
+        return done
+
+    def write_page(self, key, text):
+        '''
+            append text of a page, and then record it in checkpoint
+        '''
+        if self.page_marker is not None:
+            text=(self.page_marker % key)+'\n'+text
+
+        self._f.write((text+'\n').encode())
+        self._f.flush()
+
+        self._fckpt.write(json.dumps([self._f.tell(), key])+'\n')
+        self._fckpt.flush()
+
+    def close(self):
+        for f in [self._f, self._fckpt]:
+            if f is not None:
+                f.close()
+
+        self._f=self._fckpt=None
+
+def ocr_images_in_dir(dir_images, fname_out=None, **kwargs):
     '''
         ocr images in a directory
+
+        optional keyword arguments are passed to `ocr_images_list`
     '''
     images=list_files_in_dir(dir_images)
-    ocr_images_list(images, fname_out=fname_out)
+    ocr_images_list(images, fname_out=fname_out, **kwargs)
 
 def ocr_images_by_namefmt(fname_format='page-%i.png', dir_images='pages',
-                        page_range=None, fname_out=None):
+                        page_range=None, fname_out=None, **kwargs):
     '''
         ocr images through list of names with similar format
+
+        if a manifest exists in `dir_images`,
+            checksum of images recorded in it is used to identify pages in checkpoint
+
+        optional keyword arguments are passed to `ocr_images_list`
     '''
     fnames=list_files_by_range_fmt(dir_images=dir_images,
                                    fname_format=fname_format,
                                    page_range=page_range)
 
-    ocr_images_list(fnames, fname_out=fname_out)
+    # checksum in manifest is used in keys for checkpoint
+    #     so that a re-rendered image would be ocr-ed again in resuming
+    manifest=load_manifest(dir_images)
+    if manifest['files'] and 'keys' not in kwargs:
+        keys=[]
+        for fname in fnames:
+            checksum=get_file_checksum(dir_images, manifest, os.path.basename(fname))
+            keys.append('%s %s' % (fname, checksum))
+        kwargs['keys']=keys
+
+    ocr_images_list(fnames, fname_out=fname_out, **kwargs)
+
+@traced
+def ocr_pdf(pdfname, page_range=None, fname_out=None, resume=False, page_marker=None,
+                queue_size=4, dir_image=None, fname_format='page-%i.png', zoomxy=2,
+                progress=None, **kwargs):
+    '''
+        ocr pages in a PDF, without intermediate image files
+
+        pages are rendered in background and streamed to ocr through a bounded queue
+            see `funcs_image.yield_arrays_from_pdf` for detail
+
+        page_range must be given with `one_started` and `keep_end`
+
+        Parameters:
+            resume, page_marker, progress:
+                see `ocr_images_list`
+                page id is used as key of page
+
+            dir_image: None or str
+                if given, also write pages to image files in this directory
+
+            optional keyword arguments are passed to `yield_ocr_texts`
+    '''
+    pageids=get_pageids_of_pdf(pdfname, page_range=page_range)
+
+    n=0
+    if fname_out is not None:
+        writer=OcrTextWriter(fname_out, page_marker=page_marker)
+        n=writer.open(pageids, resume=resume)
+
+    pages=yield_arrays_from_pdf(pdfname, pageids=pageids[n:], queue_size=queue_size,
+                                dir_image=dir_image, fname_format=fname_format,
+                                zoomxy=zoomxy)
+    images=(img for _, img in pages)
+
+    if fname_out is None:
+        prog=get_progress(progress, total=len(pageids), desc='ocr %s' % pdfname)
+        return join_ocr_texts(yield_ocr_texts(images, **kwargs), prog)
+
+    write_ocr_texts(writer, zip(pageids[n:], images), total=len(pageids)-n,
+                            progress=progress, **kwargs)
@@ -10,14 +10,20 @@ two types of representation: nest (nested list), level (explicit level specified
         e.g. [(t1, p1, 0), (t2, p2, 1), (t3, p3 1)]
 '''
 
+import os
 import numbers
 import re
 
 import numpy as np
 
-from PyPDF2.generic import NullObject
+from PyPDF2.generic import NullObject, IndirectObject, NameObject, NumberObject, \
+                          ArrayObject, DictionaryObject, createStringObject
 
-from .funcs_rw import open_pdf_as_reader
+from .cache import DirCache, hash_bytes, file_fingerprint
+from .funcs_page import map_pages_with_extras
+from .funcs_trace import count
+from .funcs_rw import open_pdf_as_reader, get_page_refs_of_writer, \
+                      get_outline_root_ref_of_writer, get_object_to_update
 
 # from pdf
 def get_outlines_from_reader(reader, page_shift=0):
@@ -28,62 +34,239 @@ def get_outlines_from_reader(reader, page_shift=0):
                 `page number` also starts from 0
     '''
     outlines=reader.getOutlines()
-    return parse_outlines_list(outlines, reader, page_shift=page_shift)
+    pagemap=get_page_index_map(reader)
 
-def get_outlines_from_pdf(pdfname, page_shift=0):
+    return parse_outlines_list(outlines, pagemap, page_shift=page_shift)
+
+def get_outlines_from_pdf(pdfname, page_shift=0, cache=None):
     '''
         get outlines from a pdf file
+
+        Parameters:
+            cache: None, str or `DirCache`
+                cache of outlines, keyed by the pdf file
+                    if str, it is the cache directory
+                see `get_outline_cache` for detail
+    '''
+    cache=get_outline_cache(cache)
+    if cache is None:
+        reader=open_pdf_as_reader(pdfname)
+        return get_outlines_from_reader(reader, page_shift=page_shift)
+
+    key=outline_cache_key(pdfname)
+    outlines=load_outline_cache(cache, key)
+
+    if outlines is not None:
+        count('outline cache hits')
+    else:
+        reader=open_pdf_as_reader(pdfname)
+        outlines=get_outlines_from_reader(reader)
+        save_outline_cache(cache, key, outlines)
+
+    if page_shift:
+        for entry in outlines:
+            if entry[1]>=0:
+                entry[1]+=page_shift
+
+    return outlines
+
+## cache of outlines
+_outline_cache_magic=b'PDFOUTL1'
+
+def get_outline_cache(cache, max_size=2**26):
+    '''
+        cache for outlines of pdf files
+
+        `cache` could be None, a directory name or `DirCache`
+            for directory name, size of cache is bounded by `max_size`
+    '''
+    if cache is None or isinstance(cache, DirCache):
+        return cache
+
+    return DirCache(cache, max_size=max_size, suffix='.outl')
+
+def outline_cache_key(pdfname):
+    '''
+        key of outlines for a pdf file
+
+        made from path, size, mtime and fingerprint of content
+    '''
+    st=os.stat(pdfname)
+    stat='%s %i %i' % (os.path.abspath(pdfname), st.st_size, st.st_mtime_ns)
+
+    return hash_bytes(stat.encode(), file_fingerprint(pdfname).encode())
+
+def invalidate_outline_cache(cache, pdfname=None):
+    '''
+        remove cached outlines of a pdf file
+            or all entries if `pdfname` is None
+    '''
+    cache=get_outline_cache(cache)
+
+    if pdfname is None:
+        cache.clear()
+    else:
+        cache.remove(outline_cache_key(pdfname))
+
+def load_outline_cache(cache, key):
+    '''
+        load outlines, list of [title, page, level], from cache
+
+        return None if not cached, or entry is broken
+    '''
+    data=cache.get(key)
+    if data is None:
+        return None
+
+    try:
+        return unpack_outlines(data)
+    except ValueError:
+        cache.remove(key)
+        return None
+
+def save_outline_cache(cache, key, outlines):
+    cache.put(key, pack_outlines(outlines))
+
+def pack_outlines(outlines):
     '''
-    reader=open_pdf_as_reader(pdfname)
-    return get_outlines_from_reader(reader, page_shift=page_shift)
+        pack outlines, list of [title, page, level], to bytes
 
-def parse_outlines_list(outlines, reader, level=0, page_shift=0):
+        layout:
+            magic, number of entries n, as int64
+            n pages, n levels, n lengths of titles in bytes, as int32
+            titles encoded by utf-8
+    '''
+    titles=[t.encode('utf-8', 'surrogatepass') for t, _, _ in outlines]
+    pages=np.array([p for _, p, _ in outlines], dtype='<i4')
+    levels=np.array([l for _, _, l in outlines], dtype='<i4')
+    lens=np.array([len(t) for t in titles], dtype='<i4')
+
+    head=_outline_cache_magic+np.array([len(outlines)], dtype='<i8').tobytes()
+
+    return b''.join([head, pages.tobytes(), levels.tobytes(), lens.tobytes()]+titles)
+
+def unpack_outlines(data):
+    '''
+        unpack bytes made by `pack_outlines`
+
+        raise ValueError for broken data
+    '''
+    nmagic=len(_outline_cache_magic)
+    if data[:nmagic]!=_outline_cache_magic:
+        raise ValueError('unexpected head of outlines data')
+
+    n=int(np.frombuffer(data, dtype='<i8', count=1, offset=nmagic)[0])
+
+    offset=nmagic+8
+    pages, levels, lens=np.frombuffer(data, dtype='<i4', count=3*n, offset=offset).reshape(3, n)
+    offset+=12*n
+
+    ends=(offset+np.cumsum(lens)).tolist()
+    if (ends[-1] if n else offset)!=len(data):
+        raise ValueError('unexpected size of outlines data')
+
+    text=[]
+    start=offset
+    for end in ends:
+        text.append(data[start:end].decode('utf-8', 'surrogatepass'))
+        start=end
+
+    return list(map(list, zip(text, pages.tolist(), levels.tolist())))
+
+def parse_outlines_list(outlines, pagemap, level=0, page_shift=0):
     '''
         parse outline list gotten directly from PyPDF2 reader
 
         return [title, page number, level]
 
         Parameters:
+            pagemap: PyPDF2 reader, or dict
+                map from page object to page index
+                    see `get_page_index_map` for detail
+
             level: int
                 current outline level
     '''
-    result=parse_outlines_nest(outlines, reader, page_shift=page_shift)
+    result=parse_outlines_nest(outlines, pagemap, page_shift=page_shift)
 
     return outline_nest_to_level(result, level=level)
 
-def parse_outlines_nest(outlines, reader, page_shift=0, remove_unprintable=True):
+def parse_outlines_nest(outlines, pagemap, page_shift=0, remove_unprintable=True):
     '''
         parse outline list gotten directly from PyPDF2 reader
 
         return nested outlines, [(t1, p1), [(t2, p2), (t3, p3)]]
 
         Parameters:
+            pagemap: PyPDF2 reader, or dict
+                map from page object to page index
+                if reader, the map is built from it
+
             page_shift: int
 
             remove_unprintable: bool
                 wheter remove unprintable char, e.g. '\x00'
     '''
+    if not isinstance(pagemap, dict):
+        pagemap=get_page_index_map(pagemap)
+
+    # stack of (iterator of nested list, list of result)
     result=[]
-    for entry in outlines:
+    stack=[(iter(outlines), result)]
+    while stack:
+        entries, holder=stack[-1]
+
+        entry=next(entries, None)
+        if entry is None:
+            stack.pop()
+            continue
+
         if '/Title' in entry:
             title=entry['/Title']
             if remove_unprintable:
                 title=str_clean_unprintable(title)
 
-            if isinstance(entry.getDestArray()[0], NullObject):
-            # if not hasattr(entry.getDestArray()[0], 'idnum'):
-                page=-1
-            else:
-                page=reader.getDestinationPageNumber(entry)
+            page=get_dest_page_number(entry, pagemap)
+            if page>=0:
                 page+=page_shift
-            result.append([title, page])
+            holder.append([title, page])
             continue
 
-        subout=parse_outlines_nest(entry, reader, page_shift=page_shift)
-        result.append(subout)
+        holder.append([])
+        stack.append((iter(entry), holder[-1]))
 
     return result
 
+def get_page_index_map(reader):
+    '''
+        map from object number of page to page index, starting from 0
+
+        built once for a reader,
+            and used to resolve destinations without scanning pages
+    '''
+    pagemap={}
+    for i in range(reader.getNumPages()):
+        pagemap[reader.getPage(i).indirectRef.idnum]=i
+
+    return pagemap
+
+def get_dest_page_number(dest, pagemap):
+    '''
+        page index of a destination, e.g. outline entry
+
+        return -1 if page not found
+    '''
+    page=dest.getDestArray()[0]
+
+    if isinstance(page, NullObject):
+        return -1
+
+    if isinstance(page, IndirectObject):
+        return pagemap.get(page.idnum, -1)
+
+    # page number for remote destination
+    return int(page)
+
 def str_clean_unprintable(s):
     '''
         remove unprintable chars, like '\x00'
@@ -94,7 +277,7 @@ def str_clean_unprintable(s):
 
 # from txt file
 def get_outlines_from_txt(fname, offset=0, lstrip=True, func_level=None,
-                                 extra_pages=None):
+                                 extra_pages=None, pagelabels=None):
     '''
         parse text file to the list of entries [title, page number, level]
             see `get_outlines_from_reader` for detail
@@ -120,50 +303,282 @@ def get_outlines_from_txt(fname, offset=0, lstrip=True, func_level=None,
 
             extra_pages: None or list of int
                 extra pages which is not in normal page number
-    '''
-    # strip
-    strip=lambda line: line.rstrip()
-    if lstrip:
-        strip=lambda line: line.strip()
 
+            pagelabels: None or `funcs_pagelabel.PageLabelIndex`
+                if given, page in text is printed label, e.g. xii, A-3,
+                    which is resolved to page index by the index
+                    and then `offset` and `extra_pages` are not used
+    '''
     # func level
+    kwargs={}
     if func_level is None:
-        func_level=lambda title, page: 0
+        pass
     elif isinstance(func_level, numbers.Integral):
-        level=int(func_level)
-        func_level=lambda title, page, l=level: l
+        kwargs['level_default']=int(func_level)
     elif type(func_level) is str:
-        # current named functions
-        funcs_named={'sec': level_parser_sec}
-        func_level=funcs_named[func_level]
-    elif not callable(func_level):
+        # current named rules
+        rules_named={'sec': dict(parse_sec=True)}
+        kwargs.update(rules_named[func_level])
+    elif callable(func_level):
+        kwargs['func_level']=func_level
+    else:
         raise Exception('unexpected func_level:', func_level)
 
-    # extra pages
-    if extra_pages is not None:
-        extra_pages=np.array(extra_pages)
+    # page labels
+    if pagelabels is not None:
+        def func_page(label):
+            page=pagelabels.page_of(label)
+            if page is None:
+                raise ValueError('unknown page label: %s' % label)
+            return page+1
+
+        kwargs['func_page']=func_page
+        offset=0
+        extra_pages=None
 
     # main work
-    result=[]
+    result=[[t, p, l] for t, p, l in iter_outline_txt(fname, lstrip=lstrip, **kwargs)]
+
+    # extra pages
+    pages=np.array([e[1] for e in result], dtype=int)
+    if extra_pages is not None and len(extra_pages):
+        pages=map_pages_with_extras(pages, extra_pages)
+
+    # minus 1 since page number in text starts from 1
+    for entry, page in zip(result, (pages+offset-1).tolist()):
+        entry[1]=page
+
+    return result
+
+## streaming parser of text
+_re_outline_line=re.compile(r'(?P<title>.*\S)\s+(?P<page>[+-]?\d+)(?:[lL](?P<level>[+-]?\d+))?\s*$')
+
+def parse_outline_line(line, lstrip=True):
+    '''
+        parse a line with format: title page[L(level)]
+
+        return title, page, level
+            where level is None if not given
+        or None for blank line
+    '''
+    if lstrip:
+        line=line.lstrip()
+
+    m=_re_outline_line.match(line)
+    if m is None:
+        if not line.strip():
+            return None
+        raise Exception('unexpected line in outline text:', line)
+
+    title, page, level=m.group('title', 'page', 'level')
+    if level is not None:
+        level=int(level)
+
+    return title, int(page), level
+
+def iter_outline_txt(fname, lstrip=True, map_levels=None, parse_sec=False,
+                            func_level=None, level_default=0, func_page=None):
+    '''
+        iterate lines of outline text file, with format title page[L(level)]
+            blank lines are skipped
+
+        yield (title, page, level)
+            page is the number in text, which starts from 1
+
+        for line missing level,
+            rules are used in order until level found:
+                `map_levels`, `parse_sec`, `func_level`, `level_default`
+            where the first two are compiled into one regex
+
+        line is split by `str.rpartition`,
+            and `_re_outline_line` is only used for line not splitted in this way,
+                e.g. tab before page, which is much slower
+
+        Parameters:
+            map_levels: None, dict or list of tuples
+                level for title starting with a word
+                see `compile_level_rules` for detail
+
+            parse_sec: bool or int
+                whether to parse level from section id, e.g. 1.1 for level 1
+                if int, it is used as level shift
+
+            func_level: None, or callable
+                called with `func_level(title, page)`
+                    if not sure, return None
+
+            level_default: int, or None
+                default level, if None, use previous level
+
+            func_page: None, or callable
+                to convert page field to page number, e.g. from page label
+                    raise ValueError if failed
+                in this case, level suffix is only split when whole field fails
+                if None, page field must be integral
+    '''
+    func_rule=compile_level_rules(map_levels, parse_sec)
+
+    ## level default
+    if level_default is None:
+        # use previous level
+        use_default=False
+        level_now=None
+    else:
+        assert isinstance(level_default, numbers.Integral)
+        use_default=True
+        level_now=level_default
+
     with open(fname) as f:
         for line in f:
-            title, pnumstr=strip(line).rsplit(maxsplit=1)
+            line=line.strip() if lstrip else line.rstrip()
+
+            # title page[L(level)]
+            title, _, pnum=line.rpartition(' ')
+            title=title.rstrip()
 
-            # page number, outline level
-            page, level=pagenum_parse(pnumstr)
+            try:
+                if not title:
+                    raise ValueError
 
-            # outline level
+                if func_page is not None:
+                    page, level=_parse_pagenum_by_func(pnum, func_page)
+                else:
+                    i=pnum.find('L')
+                    if i<0:
+                        i=pnum.find('l')
+
+                    if i<0:
+                        page=int(pnum)
+                        level=None
+                    else:
+                        page=int(pnum[:i])
+                        level=int(pnum[i+1:])
+            except ValueError:
+                if func_page is not None:
+                    if line.strip():
+                        raise Exception('unexpected line in outline text:', line)
+                    continue
+
+                entry=parse_outline_line(line, lstrip=lstrip)
+                if entry is None:  # blank line
+                    continue
+                title, page, level=entry
+
+            # level
             if level is None:
-                level=func_level(title, page)
+                if func_rule is not None:
+                    level=func_rule(title)
 
-            # extra pages
-            if extra_pages is not None:
-                page+=np.count_nonzero(extra_pages<page)
+                if level is None and func_level is not None:
+                    level=func_level(title, page)
 
-            # minus 1 since page number in text starts from 1
-            result.append([title, page+offset-1, level])
+                if level is None:
+                    level=level_now
 
-    return result
+            if not use_default:
+                level_now=level
+
+            yield title, page, level
+
+def _parse_pagenum_by_func(pnumstr, func_page):
+    '''
+        parse page field, page[L(level)], with page converted by `func_page`
+
+        whole field is tried as page first,
+            since `L` may be in page label, e.g. XL
+    '''
+    try:
+        return func_page(pnumstr), None
+    except ValueError:
+        i=max(pnumstr.rfind('L'), pnumstr.rfind('l'))
+        if i<=0:
+            raise
+
+        return func_page(pnumstr[:i]), int(pnumstr[i+1:])
+
+def compile_level_rules(map_levels=None, parse_sec=False):
+    '''
+        compile rules of level from title into one regex
+
+        return a function `func(title)`, returning level or None if no rule matched
+            or None if no rule given
+
+        Parameters:
+            map_levels: None, dict or list of tuples
+                if dict, e.g. {s: l}
+                    for title starting with word `s`, level is `l`
+                or list of tuples: [(s, l)], [((s1, s2), l)]
+
+                all words are compiled into one alternation
+
+            parse_sec: bool or int
+                parse level from section id in first word, e.g. 1.1 for level 1
+                if int, it is used as level shift
+                    see `level_parser_sec` for detail
+
+                used if no word in `map_levels` matched
+    '''
+    rule, map_levels, sec_shift=_get_level_rules(map_levels, parse_sec)
+    if rule is None:
+        return None
+
+    match=re.compile(r'\s*'+rule).match
+
+    def func(title):
+        m=match(title)
+        if m is None:
+            return None
+
+        word=m.group('word') if map_levels else None
+        if word:
+            return map_levels[word]
+
+        return m.group('sec').count('.')+sec_shift
+
+    return func
+
+def _get_level_rules(map_levels=None, parse_sec=False):
+    '''
+        regex pattern for level rules, matched at start of title
+            with named groups `word` for `map_levels` and `sec` for `parse_sec`
+                see `compile_level_rules` for parameters
+
+        return pattern (None if no rule), map of words to level,
+            and level shift of section (None if section not parsed)
+    '''
+    # words for level
+    if not map_levels:
+        map_levels={}
+    elif type(map_levels) is not dict:
+        # if not dict, must be [(list of strings, level)]
+        level_list=map_levels
+        map_levels={}
+        for names, level in level_list:
+            if type(names) is str:
+                names=[names]
+            for n in names:
+                map_levels[n]=level
+
+    # section, None for not parsed
+    if isinstance(parse_sec, bool):
+        sec_shift=0 if parse_sec else None
+    else:
+        sec_shift=int(parse_sec)
+
+    # regex
+    patterns=[]
+    if map_levels:
+        # longer first, for words with same beginning
+        words=sorted(map_levels, key=len, reverse=True)
+        patterns.append(r'(?P<word>%s)(?=\s|$)' % '|'.join(map(re.escape, words)))
+
+    if sec_shift is not None:
+        patterns.append(r'\S*?(?P<sec>[\dIVX]+(?:\.\d+)*)')
+
+    if not patterns:
+        return None, map_levels, sec_shift
+
+    return '(?:%s)' % '|'.join(patterns), map_levels, sec_shift
 
 def pagenum_parse(pnumstr):
     '''
@@ -176,12 +591,7 @@ def pagenum_parse(pnumstr):
                 a: page number
                 b: outline level
     '''
-    nums=pnumstr.lower().split('l')
-    if len(nums)==1:
-        return int(nums[0]), None
-
-    num, level=nums
-    return int(num), int(level)
+    return _parse_pagenum_by_func(pnumstr, int)
 
 ## some named functions for level parser
 def level_parser_sec(title, page, level_default=0):
@@ -189,33 +599,25 @@ def level_parser_sec(title, page, level_default=0):
         parse level from the section id
             which is given by like 1.1 for level 1
     '''
-    sec, *_=title.split(maxsplit=1)
-    m=re.search(r'([\dIVX]+(\.\d+)*)', sec)
-    if m:
-        return len(m.groups()[0].split('.'))-1
+    level=_level_rule_sec(title)
+    if level is None:
+        return level_default
 
-    return level_default
+    return level
+
+_level_rule_sec=compile_level_rules(parse_sec=True)
 
 def get_level_parser_map(level_map, level_default=0):
     '''
         get a level parser which is based on a map from title starting to level
     '''
-    if str(level_map) is not dict:
-        # if not dict, must be [(list of strings, level)]
-        level_list=level_map
-        level_map={}
-        for names, level in level_list:
-            if type(names) is not str:
-                for n in names:
-                    level_map[n]=level
-            else:
-                level_map[names]=level
+    func_rule=compile_level_rules(level_map)
 
     def parser(title, page, level_default=level_default):
-        starting=title.split(maxsplit=1)[0]
-        if starting in level_map:
-            return level_map[starting]
-        return level_default
+        level=func_rule(title)
+        if level is None:
+            return level_default
+        return level
 
     return parser
 
@@ -266,32 +668,28 @@ def outline_level_to_nest(outlines):
             level: level is specified explicitly,
                 e.g. [(t1, p1, 0), (t2, p2, 1), (t3, p3 1)]
     '''
-    parents=[]
-    parent=[]
-    level_prev=None
+    result=[]
 
-    result=parent
+    # stack of (list of children, level), from top to current
+    #     each one is pushed and popped at most once, so linear time
+    stack=[(result, None)]
     for title, page, level in outlines:
-        if level_prev is None:
-            level_prev=level
+        holder, level_prev=stack[-1]
 
-        if level>level_prev:
-            parents.append((parent, level_prev))
-            
-            parent.append([])
-            parent=parent[-1]
+        if level_prev is None:
+            stack[-1]=(holder, level)
+        elif level>level_prev:
+            holder.append([])
+            holder=holder[-1]
+            stack.append((holder, level))
         elif level<level_prev:
-            assert parents
-
-            while parents:
-                parent, l0=parents.pop()
-                if l0<=level:
-                    break
+            while len(stack)>1 and stack[-1][1]>level:
+                stack.pop()
+            holder, level_prev=stack[-1]
 
-            assert l0==level # not allowed new level, which not existed before
+            assert level_prev==level # not allowed new level, which not existed before
 
-        parent.append([title, page])
-        level_prev=level
+        holder.append([title, page])
 
     return result
 
@@ -319,12 +717,20 @@ def iter_nested_list(root, level=0, is_atom=lambda e: not hasattr(e, '__iter__')
     '''
     assert hasattr(root, '__iter__')
 
-    for e in root:
-        if is_atom(e):
+    # stack of iterators, with level of top one given by `level`
+    end=object()
+
+    stack=[iter(root)]
+    while stack:
+        e=next(stack[-1], end)
+        if e is end:
+            stack.pop()
+            level-=1
+        elif is_atom(e):
             yield e, level
         else:
-            for a in iter_nested_list(e, level+1, is_atom=is_atom):
-                yield a
+            stack.append(iter(e))
+            level+=1
 
 # add outlines
 def add_outlines(writer, outlines, parent=None):
@@ -333,36 +739,130 @@ def add_outlines(writer, outlines, parent=None):
 
         return number of outlines added
 
-        `exclude_invalid`: exclude invalid outline
-            which refer to page out of writer
+        Parameters:
+            parent: None or indirect reference
+                parent of outlines added
+                if None, add to outline root
     '''
-    numpages=writer.getNumPages()
-
     outlines_nest=outline_level_to_nest(outlines)
 
-    return add_outlines_nest(writer, outlines_nest)
+    return add_outlines_nest(writer, outlines_nest, parent=parent)
 
-def add_outlines_nest(writer, outlines, parent=None):
+def add_outlines_nest(writer, outlines, parent=None, fit='/Fit'):
     '''
         add outlines given by a nested type
 
-        return number of outlines added
+        the whole tree is built in one pass,
+            with First, Last, Next, Prev, Parent and Count linked directly
+                instead of `writer.addBookmark` for each entry,
+                    which walks sibling chain and looks up page every time
 
+        new entries are appended after existing children of parent
+
+        return number of outlines added
     '''
-    n=0
-    bm=None
-    for entry in outlines:
-        if is_outline_entry(entry):
-            title, page=entry
-            bm=writer.addBookmark(title, page, parent)
+    if not outlines:
+        return 0
 
-            n+=1
-        else:
-            assert bm is not None  # not allow empty parent
-            n+=add_outlines_nest(writer, entry, bm)
+    if parent is None:
+        parent=get_outline_root_ref_of_writer(writer)
+
+    pagerefs=get_page_refs_of_writer(writer)
+
+    # build items
+    first, last, n=_build_outline_items(writer, outlines, parent, pagerefs, fit)
+
+    # link to parent
+    parent_obj=get_object_to_update(writer, parent)
+
+    if '/First' not in parent_obj:
+        parent_obj[NameObject('/First')]=first[0]
+    else:
+        prev=parent_obj.raw_get('/Last')
+        get_object_to_update(writer, prev)[NameObject('/Next')]=first[0]
+        first[1][NameObject('/Prev')]=prev
+
+    parent_obj[NameObject('/Last')]=last
+    _add_outline_count(writer, parent, n)
 
     return n
 
+def _build_outline_items(writer, outlines, parent, pagerefs, fit):
+    '''
+        create outline items for nested outlines, children of `parent`
+
+        items are all open
+            that is `/Count` of an item is the number of all its descendants
+
+        return (first ref, first object), last ref, and number of items
+    '''
+    # stack of [parent ref, entries iterator, refs and objects of children, count]
+    stack=[[parent, iter(outlines), [], 0]]
+    result=None
+    while stack:
+        frame=stack[-1]
+        pref, entries, children, _=frame
+
+        entry=next(entries, None)
+        if entry is not None:
+            if is_outline_entry(entry):
+                title, page=entry
+
+                dest=ArrayObject([pagerefs[page], NameObject(fit)])
+
+                item=DictionaryObject()
+                item.update({
+                    NameObject('/Title'): createStringObject(title),
+                    NameObject('/Dest'): dest,
+                    NameObject('/Parent'): pref,
+                })
+                children.append((writer._addObject(item), item))
+                frame[3]+=1
+            else:
+                assert children  # not allow empty parent
+                stack.append([children[-1][0], iter(entry), [], 0])
+            continue
+
+        # all children done
+        stack.pop()
+
+        for (ref0, obj0), (ref1, obj1) in zip(children[:-1], children[1:]):
+            obj0[NameObject('/Next')]=ref1
+            obj1[NameObject('/Prev')]=ref0
+
+        n=frame[3]
+        if not stack:
+            result=(children[0], children[-1][0], n)
+            break
+
+        pframe=stack[-1]
+        pobj=pframe[2][-1][1]
+        if children:
+            pobj[NameObject('/First')]=children[0][0]
+            pobj[NameObject('/Last')]=children[-1][0]
+            pobj[NameObject('/Count')]=NumberObject(n)
+        pframe[3]+=n
+
+    return result
+
+def _add_outline_count(writer, ref, n):
+    '''
+        add `n` to `/Count` of an outline item and its ancestors
+            only for open items, that is positive count
+
+        outline root has no `/Parent`
+    '''
+    while ref is not None:
+        obj=get_object_to_update(writer, ref)
+
+        c=int(obj.get('/Count', 0))
+        if c<0:   # closed item, descendants not visible to outer
+            obj[NameObject('/Count')]=NumberObject(c-n)
+            break
+
+        obj[NameObject('/Count')]=NumberObject(c+n)
+        ref=obj.raw_get('/Parent') if '/Parent' in obj else None
+
 # write to text
 def write_outline_to_txt(fname, outlines):
     '''
@@ -418,11 +918,6 @@ def get_outlines_from_nest_txt(fname, delimiters=('/*', '*/'), lstrip=True):
     '''
         get outline from nested text file
     '''
-    # strip
-    strip=lambda line: line.rstrip()
-    if lstrip:
-        strip=lambda line: line.strip()
-
     # delimiters
     if type(delimiters) is str:
         d0=d1=delimiters
@@ -446,8 +941,9 @@ def get_outlines_from_nest_txt(fname, delimiters=('/*', '*/'), lstrip=True):
             elif line.startswith(d1):
                 holder=parents.pop()
             else:
-                title, page=strip(line).rsplit(maxsplit=1)
-                holder.append([title, int(page)])
+                entry=parse_outline_line(line, lstrip=lstrip)
+                if entry is not None:
+                    holder.append([entry[0], entry[1]])
 
     assert not parents
 
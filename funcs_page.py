@@ -9,8 +9,15 @@ there are two types of page
 '''
 
 import numbers
+import collections
+
+import numpy as np
+import PyPDF2.generic as PDF
+from PyPDF2.pdf import PageObject
 
 from reportlab.lib import pagesizes as PageSizes
+
+from .funcs_rw import open_pdf_as_reader, split_to_continuing_runs
 # from reportlab.lib.pagesizes import A4
 
 # remove annotations
@@ -49,36 +56,132 @@ def get_pagesize_by_name(pagesize, scale=None):
 
     return pagesize
 
-def page_resize(page, pagesize=None, scale=None, keep_ratio=True):
+def page_resize(page, pagesize=None, scale=None, keep_ratio=True, mode='wrap'):
     '''
         scale page
 
         `keep_ratio`: bool
             if True, keep the ratio of width and height of page while scaling
+
+        `mode`: 'wrap' or 'transform'
+            how content of page is scaled, see `page_scale` for detail
+    '''
+    if pagesize is None and scale is None:
+        return
+
+    sx, sy=get_resize_factors([get_pagesize_of(page)], pagesize, scale, keep_ratio)
+    page_scale(page, float(sx[0]), float(sy[0]), mode=mode)
+
+    page.cropBox=page.mediaBox
+
+def get_resize_factors(sizes, pagesize=None, scale=None, keep_ratio=True):
+    '''
+        scale factors to resize pages, in batch
+            arguments are same as `page_resize`
+
+        Parameters:
+            sizes: array-like, shape (n, 2)
+                width and height of pages
+
+        return arrays of factors in x and y axes
     '''
+    sizes=np.asarray(sizes, dtype=float).reshape(-1, 2)
+    n=len(sizes)
+
     if pagesize is None:
         if scale is None:
-            return
-
-        if isinstance(scale, numbers.Number):
-            page.scaleBy(float(scale))
+            sx=sy=1
+        elif isinstance(scale, numbers.Number):
+            sx=sy=float(scale)
         else:
             # scale=(sx, sy), scale in both axes
-            page.scale(*scale)
+            sx, sy=scale
 
-        page.cropBox=page.mediaBox
+        return np.full(n, sx, dtype=float), np.full(n, sy, dtype=float)
 
-        return
+    w, h=get_pagesize_by_name(pagesize, scale)
+    sx=w/sizes[:, 0]
+    sy=h/sizes[:, 1]
 
-    pagesize=get_pagesize_by_name(pagesize, scale)
     if keep_ratio:
-        w0, h0=get_pagesize_of(page)
-        w, h=pagesize
-        page.scaleBy(min(w/w0, h/h0))
-    else:
-        page.scaleTo(*pagesize)
-    
-    page.cropBox=page.mediaBox
+        sx=sy=np.minimum(sx, sy)
+
+    return sx, sy
+
+def select_pages_to_resize(sx, sy, tol=None):
+    '''
+        indices of pages, whose scale factors differ from 1 beyond tolerance
+
+        `tol`: relative tolerance, if None, use `pagesize_tolerance`
+    '''
+    if tol is None:
+        tol=pagesize_tolerance
+
+    return np.nonzero((np.abs(sx-1)>tol) | (np.abs(sy-1)>tol))[0]
+
+def page_scale(page, sx, sy, mode='wrap'):
+    '''
+        scale page by factors in two axes
+
+        Parameters:
+            mode: 'wrap' or 'transform'
+                'wrap': original content streams are kept unchanged,
+                    and wrapped by two short streams, `q sx 0 0 sy 0 0 cm` and `Q`
+                    no stream is decoded, which is fast for scanned books
+                'transform': by PyPDF2 `scale`,
+                    which decodes content stream, and encodes it with matrix
+    '''
+    if mode=='transform':
+        page.scale(sx, sy)
+        return
+
+    if mode!='wrap':
+        raise Exception('unexpected mode of page scaling:', mode)
+
+    # content
+    if '/Contents' in page:
+        contents=page.raw_get('/Contents')
+
+        streams=contents.getObject()
+        if not isinstance(streams, PDF.ArrayObject):  # a single stream
+            streams=[contents]
+
+        pre=b'q %s 0 0 %s 0 0 cm\n' % (_format_number(sx), _format_number(sy))
+
+        wrapped=PDF.ArrayObject()
+        wrapped.append(_content_stream(pre))
+        wrapped.extend(streams)
+        wrapped.append(_content_stream(b'\nQ'))
+
+        page[PDF.NameObject('/Contents')]=wrapped
+
+    # boxes, as done in PyPDF2 `scale`
+    page.mediaBox=_scale_rect(page.mediaBox, sx, sy)
+
+    if '/VP' in page:
+        viewports=page['/VP']
+        if not isinstance(viewports, PDF.ArrayObject):
+            viewports=[viewports]
+
+        for vp in viewports:
+            vp=vp.getObject()
+            vp[PDF.NameObject('/BBox')]=_scale_rect(vp['/BBox'], sx, sy)
+
+def _content_stream(data):
+    stream=PDF.DecodedStreamObject()
+    stream.setData(data)
+
+    return stream
+
+def _format_number(x):
+    '''
+        format a number in content stream
+    '''
+    return ('%.6f' % x).rstrip('0').rstrip('.').encode()
+
+def _scale_rect(rect, sx, sy):
+    x0, y0, x1, y1=[float(t) for t in rect]
+    return PDF.RectangleObject([x0*sx, y0*sy, x1*sx, y1*sy])
 
 def get_pagesize_of(page):
     '''
@@ -88,30 +191,288 @@ def get_pagesize_of(page):
 
     return float(x1-x0), float(y1-y0)
 
+# page geometry of document
+pagesize_tolerance=0.01   # relative tolerance for a same page size
+
+PageGeometry=collections.namedtuple('PageGeometry', ['mediabox', 'cropbox', 'rotate'])
+
+def scan_page_geometry(reader, pages=None):
+    '''
+        collect geometry of pages in reader, without changing them
+
+        Parameters:
+            pages: None or list of int
+                indices of pages, started from 0
+                if None, all pages
+
+        return `PageGeometry` of numpy arrays
+            mediabox, cropbox: shape (n, 4), as [x0, y0, x1, y1]
+            rotate: shape (n,), in degree within [0, 360)
+    '''
+    if pages is None:
+        pages=range(reader.getNumPages())
+
+    n=len(pages)
+    mediabox=np.empty((n, 4))
+    cropbox=np.empty((n, 4))
+    rotate=np.zeros(n, dtype=int)
+
+    for k, i in enumerate(pages):
+        page=reader.getPage(i)
+
+        mediabox[k]=[float(t) for t in page.mediaBox]
+        cropbox[k]=[float(t) for t in page.cropBox]  # mediaBox if not given
+
+        if '/Rotate' in page:
+            rotate[k]=int(page['/Rotate'])
+
+    return PageGeometry(mediabox, cropbox, rotate % 360)
+
+def get_sizes_of_boxes(boxes):
+    '''
+        width and height of boxes, shape (n, 4), in batch
+    '''
+    return np.abs(boxes[:, 2:]-boxes[:, :2])
+
+def cluster_page_sizes(sizes, tol=None):
+    '''
+        cluster page sizes into classes
+
+        a size joins the first class, in order of number of pages,
+            whose width and height are both within relative tolerance `tol`
+            if None, use `pagesize_tolerance`
+
+        return sizes of classes, shape (k, 2), ordered by number of pages,
+            class of each page, and number of pages in each class
+    '''
+    if tol is None:
+        tol=pagesize_tolerance
+
+    sizes=np.asarray(sizes, dtype=float).reshape(-1, 2)
+
+    # distinct sizes first, which are few in a document
+    uniq, inverse, counts=np.unique(np.round(sizes, 2), axis=0,
+                                    return_inverse=True, return_counts=True)
+    inverse=inverse.reshape(-1)
+
+    centers=[]
+    nums=[]
+    map_uniq=np.empty(len(uniq), dtype=int)
+    for u in np.argsort(-counts, kind='stable'):
+        for c, center in enumerate(centers):
+            if np.all(np.abs(uniq[u]-center)<=tol*center):
+                break
+        else:
+            c=len(centers)
+            centers.append(uniq[u])
+            nums.append(0)
+
+        map_uniq[u]=c
+        nums[c]+=counts[u]
+
+    return np.array(centers).reshape(-1, 2), map_uniq[inverse], np.array(nums, dtype=int)
+
+def get_name_of_pagesize(size, tol=None):
+    '''
+        name of a standard page size in reportlab, e.g. A4
+            with suffix ' landscape' if width > height
+
+        return None if not found
+    '''
+    if tol is None:
+        tol=pagesize_tolerance
+
+    w, h=size
+    for name in dir(PageSizes):
+        if not name.isupper():
+            continue
+
+        w0, h0=getattr(PageSizes, name)
+        if abs(w-w0)<=tol*w0 and abs(h-h0)<=tol*h0:
+            return name
+        if abs(w-h0)<=tol*h0 and abs(h-w0)<=tol*w0:
+            return name+' landscape'
+
+    return None
+
+def report_page_geometry(pdfname, tol=None):
+    '''
+        print an inventory of page geometry in a pdf file
+            size classes of crop boxes, rotation and crop boxes
+            pages are printed as index started from 1
+
+        return list of size classes, (width, height, number of pages)
+    '''
+    reader=open_pdf_as_reader(pdfname)
+    geometry=scan_page_geometry(reader)
+
+    sizes=get_sizes_of_boxes(geometry.cropbox)
+    centers, classes, nums=cluster_page_sizes(sizes, tol=tol)
+
+    print('%i pages, %i size classes' % (len(sizes), len(centers)))
+    for c, ((w, h), n) in enumerate(zip(centers, nums)):
+        name=get_name_of_pagesize((w, h), tol=tol)
+        print('    %.1f x %.1f pt (%.1f x %.1f mm%s): %i pages, %s' %
+                (w, h, w*_mm_per_pt, h*_mm_per_pt, '' if name is None else ', '+name,
+                 n, format_page_runs(np.nonzero(classes==c)[0]+1)))
+
+    rotated=np.nonzero(geometry.rotate)[0]
+    if len(rotated):
+        print('rotated: %i pages, %s' % (len(rotated), format_page_runs(rotated+1)))
+
+    cropped=np.nonzero(np.any(np.abs(geometry.cropbox-geometry.mediabox)>1e-3, axis=1))[0]
+    if len(cropped):
+        print('cropped: %i pages, %s' % (len(cropped), format_page_runs(cropped+1)))
+
+    return [(float(w), float(h), int(n)) for (w, h), n in zip(centers, nums)]
+
+_mm_per_pt=25.4/72
+
+def format_page_runs(pages, max_runs=5):
+    '''
+        format sorted page numbers as runs, e.g. '1-5, 8'
+    '''
+    runs=split_to_continuing_runs(np.asarray(pages).tolist())
+
+    items=['%i' % p if len(ps)==1 else '%i-%i' % (p, ps[-1]) for p, ps in runs[:max_runs]]
+    if len(runs)>max_runs:
+        items.append('...')
+
+    return ', '.join(items)
+
+# logical to physical page mapping
+def map_pages_with_extras(pages, extra_pages):
+    '''
+        map logical page numbers to physical ones,
+            with extra pages inserted
+
+        an extra page `e` is inserted after logical page `e`,
+            so page `p` is shifted by number of extras before it, that is `e<p`
+        multiple extra pages could be after a same page
+
+        Parameters:
+            pages: int or array of int
+                logical page numbers, starting from 1
+
+            extra_pages: array of int
+                logical page numbers, after which extra pages are inserted
+
+        return physical page numbers starting from 1, with same shape as `pages`
+    '''
+    extras=np.sort(extra_pages)
+
+    return pages+np.searchsorted(extras, pages, side='left')
+
+def get_extra_page_indices(extra_pages):
+    '''
+        physical indices of extra pages, starting from 0
+            see `map_pages_with_extras` for detail
+
+        return sorted logical pages before extras, and their physical indices
+    '''
+    extras=np.sort(np.asarray(extra_pages, dtype=int))
+
+    # i-th extra page is after logical page `e` and `i` extra pages
+    return extras, extras+np.arange(len(extras))
+
 # add blank pages
 def add_blank_page_after(writer, page):
     '''
         add blank page after `page`
 
         `page` is an index started from 1
+            see `insert_blank_pages` for detail
     '''
-    writer.insertBlankPage(index=page)
+    insert_blank_pages(writer, [page])
 
 def add_blank_pages_after(writer, pages):
     '''
         add blank page after `page`
 
         page in `pages` is an index started from 1
+
+        `/Kids` of writer is rebuilt in one pass
+            see `insert_blank_pages` for detail
     '''
     if isinstance(pages, numbers.Integral):
         # only adding one page
-        add_blank_page_after(writer, pages)
-        return 1
+        pages=[pages]
+
+    return insert_blank_pages(writer, pages)
+
+def insert_blank_pages(writer, extra_pages):
+    '''
+        insert blank pages in bulk
+
+        a blank page is of the size of the page after it,
+            or of the last page if at the end
+        all blank pages share a same empty `/Resources` object
 
-    for page in sorted(pages, reverse=True):
-        add_blank_page_after(writer, page)
+        outlines in writer refer to page objects, not changed by insertion
+        page labels are remapped, with blank pages in run of the page before
 
-    return len(pages)
+        Parameters:
+            extra_pages: array of int
+                logical page numbers, after which blank pages are inserted
+                    see `map_pages_with_extras` for detail
 
+        return number of pages inserted
+    '''
+    # pyPDF2 writer
+    pages_obj=writer.getObject(writer._pages)
+    kids=pages_obj['/Kids']
+
+    n=len(kids)
+    if n==0:
+        raise Exception('no page in writer to insert blank pages')
+
+    extras=np.sort(np.asarray(extra_pages, dtype=int))
+    if len(extras)==0:
+        return 0
+
+    if extras[0]<0:
+        raise Exception('unexpected page to insert after:', int(extras[0]))
+
+    # shared objects
+    resources=writer._addObject(PDF.DictionaryObject())
+
+    def get_size(i):
+        box=kids[i].getObject().mediaBox
+        return box.getWidth(), box.getHeight()
+
+    # new /Kids in one pass
+    new_kids=PDF.ArrayObject()
 
+    i0=0
+    for e in extras.tolist():
+        e=min(e, n)
+        new_kids.extend(kids[i0:e])
+        i0=e
 
+        blank=PageObject.createBlankPage(writer, *get_size(min(e, n-1)))
+        blank[PDF.NameObject('/Parent')]=writer._pages
+        blank[PDF.NameObject('/Resources')]=resources
+
+        new_kids.append(writer._addObject(blank))
+    new_kids.extend(kids[i0:])
+
+    pages_obj[PDF.NameObject('/Kids')]=new_kids
+    pages_obj[PDF.NameObject('/Count')]=PDF.NumberObject(len(new_kids))
+
+    # page labels, avoiding circular import
+    from .funcs_pagelabel import remap_pagelabels
+    remap_pagelabels(writer, lambda p: map_pages_after_blanks(p, extras))
+
+    return len(extras)
+
+def map_pages_after_blanks(pages, extra_pages):
+    '''
+        map page indices, started from 0, to ones after blank pages inserted
+            see `insert_blank_pages`
+
+        same mapping as `map_pages_with_extras`, with indices shifted by 1,
+            except that page 0 is kept at 0,
+                so blank pages before it fall in the page label run starting there
+    '''
+    pages=np.asarray(pages)
+    return np.where(pages>0, map_pages_with_extras(pages+1, extra_pages)-1, 0)
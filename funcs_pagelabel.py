@@ -4,11 +4,13 @@
 Functions for PDF page label
 '''
 
-import collections
+import bisect
 
+import numpy as np
 import PyPDF2.generic as PDF
 
-from .funcs_rw import get_root_of_rw
+from .funcs_rw import get_root_of_rw, open_pdf_as_reader
+from .funcs_page import get_extra_page_indices
 
 # objects for page label
 ## named style: see "https://www.w3.org/TR/WCAG20-TECHS/PDF17.html" for detail
@@ -32,8 +34,10 @@ def obj_pagelabels(style=None, start=None, prefix=None):
         object for page label
 
         Paramters:
-            style: string
+            style: string or None
                 specify style of page labels, like Roman or Arabic
+                if None, use arabic
+                if '', no numbering, that is no /S in page label
 
             start: optional, None, int
                 start page
@@ -44,14 +48,11 @@ def obj_pagelabels(style=None, start=None, prefix=None):
         start=1
 
     # style
-    global _map_style
-    if style in _map_style:
-        style=_map_style[style]
-    elif style is None:
-        style=_map_style['arabic']
+    style=get_style_name(style)
 
     obj=PDF.DictionaryObject()
-    obj.update({PDF.NameObject("/S"):PDF.NameObject(style)})
+    if style:
+        obj.update({PDF.NameObject("/S"):PDF.NameObject(style)})
     obj.update({PDF.NameObject("/St"): PDF.NumberObject(start)})
 
     if prefix is not None:
@@ -60,6 +61,22 @@ def obj_pagelabels(style=None, start=None, prefix=None):
 
     return obj
 
+def get_style_name(style=None):
+    '''
+        name of page label style in PDF, e.g. '/D'
+
+        `style` could be a name in PDF, or an alias in `_map_style`
+            if None, use arabic
+            if '', return '', for page labels without numbering
+    '''
+    if style is None:
+        return _map_style['arabic']
+
+    if style in _map_style:
+        return _map_style[style]
+
+    return style
+
 def obj_nums_array(page, **kwargs):
     '''
         object for Nums in page labels
@@ -75,8 +92,14 @@ def obj_nums_array(page, **kwargs):
 def add_pagelabel(writer, page, style=None, start=None, prefix=None):
     '''
         add a page label to writer
+            see `obj_pagelabels` for arguments
     '''
-    nums_array=locate_pagelabels_in_writer(writer, add_ifnot=True)['/Nums']
+    labels=locate_pagelabels_in_writer(writer, add_ifnot=True)
+    if '/Nums' not in labels:   # number tree with /Kids, e.g. normalized before
+        normalize_pagelabels(writer, flat=True)
+        labels=locate_pagelabels_in_writer(writer)
+
+    nums_array=labels['/Nums']
     nums_array.extend(obj_nums_array(page, style=style, start=start, prefix=prefix))
 
 def add_pagelabels(writer, pagelabels):
@@ -108,29 +131,25 @@ def add_pagelabel_head(writer, num_head, style=None):
 def add_pagelabel_extras(writer, extra_pages, num_head=0, style='alphabet', prefix=True):
     '''
         add page label for extra pages
+
+        `extra_pages`: logical pages, starting from 1, after which extras are
+            see `funcs_page.map_pages_with_extras` for detail
     '''
-    # sort pages
-    cnt_pages_sort=collections.Counter()
-    for p in extra_pages:  # page index starting from 1
-        cnt_pages_sort[p]+=1
-    pages_sort=sorted(cnt_pages_sort.items(), key=lambda t: t[0])
+    extras, indices=get_extra_page_indices(extra_pages)
+    pages, firsts, counts=np.unique(extras, return_index=True, return_counts=True)
 
     if not prefix:
         prefix=None
 
     # add page label
-    for p, n in pages_sort:
-        if n<=0:
-            continue
-
+    for p, i, n in zip(pages.tolist(), firsts.tolist(), counts.tolist()):
         if prefix is not None:
             prefix=str(p)
 
-        # 2nd arg is page after `p`, by index starting from 0.
-        add_pagelabel(writer, p+num_head, style=style, prefix=prefix)   # actually +1-1
-
-        num_head+=n
-        add_pagelabel(writer, p+num_head, style='arabic', start=p+1)
+        # physical indices of extra pages after `p`, starting from 0
+        i0=int(indices[i])+num_head
+        add_pagelabel(writer, i0, style=style, prefix=prefix)
+        add_pagelabel(writer, i0+n, style='arabic', start=p+1)
 
 # get page labels
 def locate_pagelabels_in_writer(writer, add_ifnot=False):
@@ -162,31 +181,433 @@ def get_pagelabels_from_reader(reader, page_shift=0):
     '''
         get the page label object in PyPDF2 reader
 
-        return a list of page labels, [page, style, start]
+        both flat `/Nums` array and nested number tree with `/Kids` are supported
+
+        return a list of page labels, [page, style[, start[, prefix]]]
+            style is '' if no numbering
     '''
     root_obj=get_root_of_rw(reader)
     if '/PageLabels' not in root_obj:
         return []
 
-    nums_array=root_obj['/PageLabels']['/Nums']
-
-    n=len(nums_array)
-    assert n % 2 == 0
-
     result=[]
-    for i in range(0, n, 2):
-        page=int(nums_array[i])+page_shift
-
-        ss=nums_array[i+1]
-        if isinstance(ss, PDF.IndirectObject):
-            # ss=reader.getObject(ss)
-            ss=ss.getObject()
-        style=str(ss['/S'])
+    for page, ss in iter_number_tree(root_obj['/PageLabels']):
+        ss=ss.getObject()
+        style=str(ss['/S']) if '/S' in ss else ''
 
-        pagelabel=[page, style]
+        pagelabel=[page+page_shift, style]
         result.append(pagelabel)
 
-        if '/St' in ss:
-            pagelabel.append(int(ss['/St']))
+        if '/St' in ss or '/P' in ss:
+            pagelabel.append(int(ss['/St']) if '/St' in ss else None)
+
+        if '/P' in ss:
+            pagelabel.append(str(ss['/P']))
 
     return result
+
+def iter_number_tree(node):
+    '''
+        iterate (key, value) in a number tree, e.g. `/PageLabels`
+            in order of `/Kids`, that is ascending keys
+
+        walk is done with a stack, instead of recursion
+    '''
+    stack=[node.getObject()]
+    while stack:
+        node=stack.pop()
+
+        if '/Nums' in node:
+            nums=node['/Nums']
+
+            n=len(nums)
+            assert n % 2 == 0
+
+            for i in range(0, n, 2):
+                yield int(nums[i]), nums[i+1]
+
+        if '/Kids' in node:
+            kids=node['/Kids']
+            for i in range(len(kids)-1, -1, -1):  # first kid on top
+                stack.append(kids[i].getObject())
+
+# normalized page labels
+pagelabel_node_size=64   # max number of runs or kids in a node of number tree
+
+class PageLabelBuilder:
+    '''
+        builder of page labels, which collects all runs before written
+
+        runs are normalized when built:
+            sorted by start page
+            a later run at the same page shadows earlier ones
+            a run continuing the previous one is redundant and dropped,
+                that is with same style, prefix and following numbers
+            runs not before `num_pages` are dropped
+            page 0 is given arabic labels if not covered,
+                since number tree of page labels must include it
+
+        few runs are written as a flat `/Nums` array,
+            otherwise as a balanced number tree with `/Kids` and `/Limits`
+    '''
+    def __init__(self, num_pages=None):
+        self.num_pages=num_pages
+        self.runs={}  # {page: (style, start, prefix)}, style '' for no numbering
+
+    @classmethod
+    def from_rw(cls, rw):
+        '''
+            builder with page labels existing in a reader or writer
+        '''
+        builder=cls(rw.getNumPages())
+        for page, *ss in get_pagelabels_from_reader(rw):
+            style, start, prefix=(ss+[None, None, None])[:3]
+            builder.runs[page]=(style, 1 if start is None else start, prefix or '')
+
+        return builder
+
+    def add(self, page, style=None, start=None, prefix=None):
+        '''
+            add a run of page labels starting at `page`, index started from 0
+
+            arguments are same as `obj_pagelabels`
+                style None for arabic, and '' for no numbering
+        '''
+        self.runs[page]=(get_style_name(style), 1 if start is None else start,
+                         prefix or '')
+
+    def add_pagelabels(self, pagelabels):
+        '''
+            add a list of page labels, [page, style[, start[, prefix]]]
+        '''
+        for page, *ss in pagelabels:
+            self.add(page, *ss)
+
+        return len(pagelabels)
+
+    # normalize
+    def get_runs(self):
+        '''
+            normalized runs, list of (page, style, start, prefix)
+        '''
+        pages=sorted(self.runs)
+        if self.num_pages is not None:
+            pages=pages[:bisect.bisect_left(pages, self.num_pages)]
+
+        if not pages:
+            return []
+
+        runs=[]
+        if pages[0]>0:
+            runs.append((0, '/D', 1, ''))
+
+        for page in pages:
+            style, start, prefix=self.runs[page]
+
+            if runs:
+                p0, style0, start0, prefix0=runs[-1]
+                if style==style0 and prefix==prefix0 and \
+                   (not style or start==start0+page-p0):
+                    continue
+
+            runs.append((page, style, start, prefix))
+
+        return runs
+
+    # build
+    def build(self, writer, flat=False, node_size=None):
+        '''
+            write page labels to writer, replacing existing ones
+
+            Parameters:
+                flat: bool
+                    if True, always write a flat `/Nums` array
+
+                node_size: None or int
+                    max number of runs in a leaf, or kids in other nodes
+                    if None, use `pagelabel_node_size`
+
+            return number of runs written
+        '''
+        if node_size is None:
+            node_size=pagelabel_node_size
+
+        root_obj=get_root_of_rw(writer)
+
+        runs=self.get_runs()
+        if not runs:
+            if '/PageLabels' in root_obj:
+                del root_obj['/PageLabels']
+            return 0
+
+        if flat or len(runs)<=node_size:
+            labels=PDF.DictionaryObject()
+            labels[PDF.NameObject('/Nums')]=_obj_nums_of_runs(runs)
+        else:
+            labels=_obj_number_tree(writer, runs, node_size)
+
+        root_obj[PDF.NameObject('/PageLabels')]=labels
+
+        return len(runs)
+
+def _obj_pagelabel_run(style, start, prefix):
+    '''
+        page label dict of a run, with default entries omitted
+    '''
+    obj=PDF.DictionaryObject()
+
+    if style:
+        obj[PDF.NameObject('/S')]=PDF.NameObject(style)
+
+    if start!=1:
+        obj[PDF.NameObject('/St')]=PDF.NumberObject(start)
+
+    if prefix:
+        obj[PDF.NameObject('/P')]=PDF.TextStringObject(prefix)
+
+    return obj
+
+def _obj_nums_of_runs(runs):
+    nums=PDF.ArrayObject()
+    for page, *ss in runs:
+        nums.append(PDF.NumberObject(page))
+        nums.append(_obj_pagelabel_run(*ss))
+
+    return nums
+
+def _obj_limits(first, last):
+    return PDF.ArrayObject([PDF.NumberObject(first), PDF.NumberObject(last)])
+
+def _split_evenly(items, size):
+    '''
+        split a list to fewest chunks with at most `size` items,
+            lengths of which differ by at most 1
+    '''
+    k=-(-len(items)//size)
+    q, r=divmod(len(items), k)
+
+    chunks=[]
+    i=0
+    for j in range(k):
+        n=q+1 if j<r else q
+        chunks.append(items[i:i+n])
+        i+=n
+
+    return chunks
+
+def _obj_number_tree(writer, runs, node_size):
+    '''
+        root of balanced number tree for runs
+
+        all leaves are at the same depth
+            and nodes in a level are of nearly equal size
+
+        leaves and intermediate nodes are indirect objects in writer
+    '''
+    # leaves, list of (ref, first key, last key)
+    nodes=[]
+    for chunk in _split_evenly(runs, node_size):
+        leaf=PDF.DictionaryObject()
+        leaf[PDF.NameObject('/Nums')]=_obj_nums_of_runs(chunk)
+
+        first, last=chunk[0][0], chunk[-1][0]
+        leaf[PDF.NameObject('/Limits')]=_obj_limits(first, last)
+
+        nodes.append((writer._addObject(leaf), first, last))
+
+    # intermediate nodes, level by level up to root
+    while len(nodes)>node_size:
+        parents=[]
+        for chunk in _split_evenly(nodes, node_size):
+            node=PDF.DictionaryObject()
+            node[PDF.NameObject('/Kids')]=PDF.ArrayObject([ref for ref, _, _ in chunk])
+
+            first, last=chunk[0][1], chunk[-1][2]
+            node[PDF.NameObject('/Limits')]=_obj_limits(first, last)
+
+            parents.append((writer._addObject(node), first, last))
+
+        nodes=parents
+
+    root=PDF.DictionaryObject()
+    root[PDF.NameObject('/Kids')]=PDF.ArrayObject([ref for ref, _, _ in nodes])
+
+    return root
+
+def normalize_pagelabels(writer, flat=False, node_size=None):
+    '''
+        normalize page labels in writer
+            see `PageLabelBuilder` for detail
+
+        return number of runs
+    '''
+    if '/PageLabels' not in get_root_of_rw(writer):
+        return 0
+
+    return PageLabelBuilder.from_rw(writer).build(writer, flat=flat, node_size=node_size)
+
+def remap_pagelabels(writer, func_map):
+    '''
+        remap start pages of page labels in writer, e.g. after pages inserted
+
+        Parameters:
+            func_map: callable
+                map an array of page indices, started from 0, to new ones
+
+        return number of runs
+    '''
+    if '/PageLabels' not in get_root_of_rw(writer):
+        return 0
+
+    builder=PageLabelBuilder.from_rw(writer)
+
+    pages=sorted(builder.runs)
+    news=func_map(np.array(pages, dtype=int)).tolist()
+    builder.runs={q: builder.runs[p] for p, q in zip(pages, news)}
+
+    return builder.build(writer)
+
+# index of page labels
+class PageLabelIndex:
+    '''
+        index of page labels in a document, built once
+
+        page to label: binary search in start pages of label ranges
+        label to page: binary search in sorted labels of all pages,
+            which are rendered in bulk when first needed
+
+        pages are indices starting from 0
+    '''
+    def __init__(self, pagelabels, num_pages):
+        '''
+            Parameters:
+                pagelabels: list of [page, style[, start[, prefix]]]
+                    as returned by `get_pagelabels_from_reader`
+
+                num_pages: int
+                    number of pages in document
+        '''
+        self.num_pages=num_pages
+
+        # label ranges, (page, style, start, prefix), sorted by page
+        ranges={}
+        for page, *ss in pagelabels:
+            style, start, prefix=(ss+[None, None, None])[:3]
+            ranges[page]=(get_style_name(style), 1 if start is None else start,
+                          prefix or '')
+
+        self._starts=sorted(ranges)
+        self._ranges=[ranges[p] for p in self._starts]
+
+        # sorted (label, page) of all pages, see `_get_sorted_labels`
+        self._sorted_labels=None
+
+    @classmethod
+    def from_reader(cls, reader):
+        return cls(get_pagelabels_from_reader(reader), reader.getNumPages())
+
+    # page to label
+    def label_of(self, page):
+        '''
+            label of a page
+
+            if no label range covers the page, use arabic number starting from 1
+        '''
+        if not 0<=page<self.num_pages:
+            raise Exception('page out of range:', page)
+
+        i=bisect.bisect_right(self._starts, page)-1
+        if i<0:
+            return str(page+1)
+
+        style, start, prefix=self._ranges[i]
+        return prefix+format_pagelabel_number(start+page-self._starts[i], style)
+
+    def labels(self):
+        '''
+            labels of all pages, rendered in bulk range by range
+        '''
+        result=[]
+
+        starts=self._starts+[self.num_pages]
+        if starts[0]>0:
+            result.extend(map(str, range(1, min(starts[0], self.num_pages)+1)))
+
+        for i, (style, start, prefix) in enumerate(self._ranges):
+            p0, p1=starts[i], min(starts[i+1], self.num_pages)
+            if p0>=p1:
+                continue
+
+            nums=range(start, start+p1-p0)
+            result.extend([prefix+format_pagelabel_number(n, style) for n in nums])
+
+        return result
+
+    # label to page
+    def page_of(self, label):
+        '''
+            page of a label, the first one if duplicated
+
+            return None if not found
+        '''
+        labels, pages=self._get_sorted_labels()
+
+        i=bisect.bisect_left(labels, label)
+        if i<len(labels) and labels[i]==label:
+            return pages[i]
+
+        return None
+
+    def _get_sorted_labels(self):
+        '''
+            labels of all pages in ascending order, and corresponding pages
+        '''
+        if self._sorted_labels is None:
+            pairs=sorted(zip(self.labels(), range(self.num_pages)))
+            self._sorted_labels=([l for l, _ in pairs], [p for _, p in pairs])
+
+        return self._sorted_labels
+
+def get_pagelabel_index(pdfname):
+    '''
+        `PageLabelIndex` of a pdf file
+    '''
+    return PageLabelIndex.from_reader(open_pdf_as_reader(pdfname))
+
+## render number of page label
+_roman_numerals=[(1000, 'M'), (900, 'CM'), (500, 'D'), (400, 'CD'),
+                 (100, 'C'), (90, 'XC'), (50, 'L'), (40, 'XL'),
+                 (10, 'X'), (9, 'IX'), (5, 'V'), (4, 'IV'), (1, 'I')]
+
+def format_pagelabel_number(n, style):
+    '''
+        format number in a page label style
+
+        Parameters:
+            style: str
+                name in PDF, e.g. '/D', '/r'
+                or '' for no numbering
+    '''
+    if style=='':
+        return ''
+
+    if style=='/D':
+        return str(n)
+
+    if style in ('/r', '/R'):
+        s=[]
+        for v, r in _roman_numerals:
+            k, n=divmod(n, v)
+            s.append(r*k)
+        s=''.join(s)
+
+        return s.lower() if style=='/r' else s
+
+    if style in ('/a', '/A'):
+        # A-Z, then AA-ZZ, AAA-ZZZ, ...
+        k, i=divmod(n-1, 26)
+        s=chr(ord('A')+i)*(k+1)
+
+        return s.lower() if style=='/a' else s
+
+    raise Exception('unexpected style of page label:', style)
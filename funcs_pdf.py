@@ -4,25 +4,56 @@
 Functions for PDF file
 '''
 
-from .funcs_rw import open_pdf_as_reader, new_writer, write_pdf_to
-from .funcs_page import page_clean_annots, page_resize, add_blank_pages_after
+from .funcs_rw import open_pdf_as_reader, new_writer, write_pdf_to, IncrementalWriter
+from .funcs_page import (page_clean_annots, page_scale, add_blank_pages_after,
+                         scan_page_geometry, get_sizes_of_boxes,
+                         get_resize_factors, select_pages_to_resize)
 from .funcs_outline import get_outlines_from_reader, add_outlines, get_outlines_from_txt
 from .funcs_pagelabel import (get_pagelabels_from_reader, add_pagelabels,
-                              add_pagelabel_head, add_pagelabel_extras)
+                              add_pagelabel_head, add_pagelabel_extras,
+                              normalize_pagelabels)
 from .funcs_path import ext_elements_by_range
+from .funcs_trace import traced, span, count
+from .funcs_progress import get_progress
 
 # pdf copy
+@traced
 def copy_pdf(pdf_old, pdf_new=None, writer=None, page_range=None, 
                 keep_annots=False, keep_outlines=True, keep_pagelabels=True,
-                pagesize=None, pagescale=None, keep_ratio=True,
-                strict=False, **kwargs):
+                pagesize=None, pagescale=None, keep_ratio=True, resize_mode='wrap',
+                resize_tol=None, strict=False, incremental=False, progress=None, **kwargs):
     '''
         copy a pdf
 
         page_range must be given with one_started=True and keep_end=True
+
+        `progress`: progress report of pages copied
+            see `funcs_progress` for detail
+
+        `resize_mode`: how pages are resized if `pagesize` or `pagescale` given
+            see `funcs_page.page_scale` for detail
+
+        `resize_tol`: relative tolerance of scale factors
+            pages with factors within it are not resized
+            if None, use `funcs_page.pagesize_tolerance`
+
+        if `incremental`, pages are not copied
+            see `copy_pdf_incremental` for detail
     '''
-    reader=open_pdf_as_reader(pdf_old, strict=strict, **kwargs)
-    nump=reader.getNumPages()
+    if incremental:
+        if writer is not None or page_range is not None or \
+           pagesize is not None or pagescale is not None:
+            raise Exception('incremental copy only supports edits of '
+                            'annotations, outlines and page labels')
+
+        return copy_pdf_incremental(pdf_old, pdf_new=pdf_new, keep_annots=keep_annots,
+                                             keep_outlines=keep_outlines,
+                                             keep_pagelabels=keep_pagelabels,
+                                             strict=strict)
+
+    with span('parse', fname=pdf_old):
+        reader=open_pdf_as_reader(pdf_old, strict=strict, **kwargs)
+        nump=reader.getNumPages()
 
     pages=range(nump)
     if page_range is not None:
@@ -34,52 +65,114 @@ def copy_pdf(pdf_old, pdf_new=None, writer=None, page_range=None,
         writer=new_writer()
     page_shift=writer.getNumPages()  # in case for not empty writer
 
+    # pages to resize, decided in batch
+    resize={}   # {page index: (sx, sy)}
+    if pagesize is not None or pagescale is not None:
+        with span('page geometry'):
+            geometry=scan_page_geometry(reader, pages)
+            sizes=get_sizes_of_boxes(geometry.mediabox)
+
+            sx, sy=get_resize_factors(sizes, pagesize, pagescale, keep_ratio)
+            for k in select_pages_to_resize(sx, sy, tol=resize_tol).tolist():
+                resize[pages[k]]=(float(sx[k]), float(sy[k]))
+        print('to resize %i pages' % len(resize))
+
     n_annots=0
     print('to copy %i pages' % len(pages))
-    for i in pages:
-        print('add page', i+1)
-        page=reader.getPage(i)
+    prog=get_progress(progress, total=len(pages), desc='copy %s' % pdf_old)
+    with span('copy pages', npages=len(pages)):
+        for i in pages:
+            page=reader.getPage(i)
 
-        if not keep_annots:
-            n=page_clean_annots(page)
-            n_annots+=n
+            if not keep_annots:
+                n=page_clean_annots(page)
+                n_annots+=n
 
-            if n:
-                print('    del %i annots in page %i' % (n, i+1))
+                if n:
+                    count('annots deleted', n)
 
-        if pagesize is not None or pagescale is not None:
-            page_resize(page, pagesize, pagescale, keep_ratio)
+            if i in resize:
+                page_scale(page, *resize[i], mode=resize_mode)
+                page.cropBox=page.mediaBox
+                count('pages resized')
 
-        writer.addPage(page)
+            writer.addPage(page)
+            count('pages copied')
+            prog.update()
 
     if not keep_annots:
         print('del %i annots in total' % n_annots)
 
     # outline
     if keep_outlines:
-        outlines=get_outlines_from_reader(reader, page_shift=page_shift)
-        n=add_outlines(writer, outlines)
+        with span('outlines'):
+            outlines=get_outlines_from_reader(reader, page_shift=page_shift)
+            n=add_outlines(writer, outlines)
         print('add %i outlines' % n)
 
     # page labels
     if keep_pagelabels:
-        pagelabels=get_pagelabels_from_reader(reader, page_shift=page_shift)
-        n=add_pagelabels(writer, pagelabels)
+        with span('pagelabels'):
+            pagelabels=get_pagelabels_from_reader(reader, page_shift=page_shift)
+            n=add_pagelabels(writer, pagelabels)
         print('add %i pagelabels' % n)
 
     # write
     if pdf_new is None:
         return writer
 
+    normalize_pagelabels(writer)
+    write_pdf_to(pdf_new, writer)
+
+@traced
+def copy_pdf_incremental(pdf_old, pdf_new=None, keep_annots=False, keep_outlines=True,
+                            keep_pagelabels=True, strict=False):
+    '''
+        copy a pdf by incremental update
+
+        only objects changed, e.g. pages with annotations deleted, Catalog,
+            are appended to the original file when saved
+                see `funcs_rw.IncrementalWriter` for detail
+
+        if `pdf_new` is None, return the writer for further edits
+    '''
+    writer=IncrementalWriter(pdf_old, strict=strict)
+
+    if not keep_annots:
+        n_annots=0
+        for i in range(writer.getNumPages()):
+            page=writer.getPage(i)
+
+            n=page_clean_annots(page)
+            if n:
+                writer.updateObject(page.indirectRef, page)
+                n_annots+=n
+
+        print('del %i annots in total' % n_annots)
+
+    root=writer._root_object
+    if not keep_outlines and '/Outlines' in root:
+        del root['/Outlines']
+
+    if not keep_pagelabels and '/PageLabels' in root:
+        del root['/PageLabels']
+
+    # write
+    if pdf_new is None:
+        return writer
+
     write_pdf_to(pdf_new, writer)
 
 # merge PDF files
+@traced
 def merge_pdfs(pdfs, pdf_new=None, writer=None,
                 keep_outlines=False, keep_pagelabels=False, **kwargs):
     '''
         merge multiply of PDF files
 
         element in `pdfs` could a file name or array [file name, page_range]
+
+        optional keyword arguments are passed to `copy_pdf`, e.g. `progress`
     '''
     if writer is None:
         writer=new_writer()
@@ -96,6 +189,12 @@ def merge_pdfs(pdfs, pdf_new=None, writer=None,
                                        keep_pagelabels=keep_pagelabels, **kw)
         print()
 
+    # page labels collected from all files
+    if keep_pagelabels:
+        with span('normalize pagelabels'):
+            n=normalize_pagelabels(writer)
+        print('normalize to %i pagelabels' % n)
+
     # write
     if pdf_new is None:
         return writer
@@ -103,16 +202,27 @@ def merge_pdfs(pdfs, pdf_new=None, writer=None,
     write_pdf_to(pdf_new, writer)
 
 # frequently used functions
+@traced
 def pdf_edit_headlabel_outline(pdf_old, pdf_new=None, num_headpage=0, foutline=None,
                                 blank_pages=None, keep_annots=False,
-                                extra_pages=None,
+                                extra_pages=None, incremental=False, progress=None,
                                 **kwargs):
     '''
         edit a pdf file, adding page label to head pages and adding outlines
+
+        if `incremental`, only changed objects are appended to the original file
+            in which case, `blank_pages` is not supported
+
+        `progress`: progress report of pages copied, see `funcs_progress`
     '''
+    if incremental and blank_pages is not None:
+        raise Exception('blank pages not supported in incremental update')
+
     writer=copy_pdf(pdf_old, keep_annots=keep_annots,
                              keep_outlines=False,
-                             keep_pagelabels=False)
+                             keep_pagelabels=False,
+                             incremental=incremental,
+                             progress=progress)
 
     if blank_pages is not None:
         n=add_blank_pages_after(writer, blank_pages)
@@ -127,6 +237,9 @@ def pdf_edit_headlabel_outline(pdf_old, pdf_new=None, num_headpage=0, foutline=N
         print('add extra page labels:', extra_pages)
         add_pagelabel_extras(writer, extra_pages, num_head=num_headpage)
 
+    if num_headpage>0 or extra_pages is not None:
+        normalize_pagelabels(writer)
+
     # outline
     if foutline is not None:
         outlines=get_outlines_from_txt(foutline, offset=num_headpage,
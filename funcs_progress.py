@@ -0,0 +1,112 @@
+#!/usr/bin/env python3
+
+'''
+Functions for progress report of long-running functions
+
+long-running functions accept an argument `progress`:
+    None: default reporter,
+        which prints a line at most every `interval` seconds, and the final one
+    False: no report
+    callable: callback, called as `progress(info)` after each item done
+        `info` is a `ProgressInfo`, (desc, done, total, rate, eta)
+            `rate`: items per second
+            `eta`: estimated seconds left, None if `total` is unknown
+'''
+
+import time
+import collections
+
+ProgressInfo=collections.namedtuple('ProgressInfo',
+                                    ['desc', 'done', 'total', 'rate', 'eta'])
+
+class Progress:
+    '''
+        progress of a task with `total` items
+    '''
+    def __init__(self, callback=None, total=None, desc=''):
+        self.callback=callback
+
+        self.total=total
+        self.desc=desc
+
+        self.done=0
+        self.t0=time.perf_counter()
+
+    def update(self, n=1):
+        '''
+            `n` more items done
+        '''
+        self.done+=n
+
+        if self.callback is not None:
+            self.callback(self.info())
+
+    def info(self):
+        '''
+            current progress as `ProgressInfo`
+        '''
+        dt=time.perf_counter()-self.t0
+        rate=self.done/dt if dt>0 else 0
+
+        eta=None
+        if self.total is not None and rate>0:
+            eta=(self.total-self.done)/rate
+
+        return ProgressInfo(self.desc, self.done, self.total, rate, eta)
+
+class ThrottledReporter:
+    '''
+        print progress at most every `interval` seconds
+
+        the last item is always reported, if total is known
+    '''
+    def __init__(self, interval=5):
+        self.interval=interval
+        self.t_last=time.perf_counter()
+
+    def __call__(self, info):
+        t=time.perf_counter()
+
+        final=info.total is not None and info.done>=info.total
+        if not final and t-self.t_last<self.interval:
+            return
+
+        self.t_last=t
+        print_progress(info)
+
+def print_progress(info):
+    '''
+        print a line for `ProgressInfo`
+    '''
+    total='?' if info.total is None else info.total
+    line='%s: %i/%s, %.1f/s' % (info.desc, info.done, total, info.rate)
+
+    if info.eta is not None:
+        line+=', ETA %s' % format_seconds(info.eta)
+
+    print(line)
+
+def format_seconds(s):
+    '''
+        format seconds to h:mm:ss
+    '''
+    m, s=divmod(int(round(s)), 60)
+    h, m=divmod(m, 60)
+
+    return '%i:%02i:%02i' % (h, m, s)
+
+def get_progress(progress=None, total=None, desc=''):
+    '''
+        `Progress` for argument `progress` of long-running functions
+            see module doc for detail
+    '''
+    if progress is None:
+        callback=ThrottledReporter()
+    elif progress is False:
+        callback=None
+    elif callable(progress):
+        callback=progress
+    else:
+        raise Exception('unexpected progress:', progress)
+
+    return Progress(callback, total=total, desc=desc)
@@ -4,7 +4,13 @@
 Functions for PDF reader/writer
 '''
 
+import os
+import shutil
+
 from PyPDF2 import PdfFileReader, PdfFileWriter
+import PyPDF2.generic as PDF
+
+from .funcs_trace import span, count
 
 # pdf reader
 def open_pdf_as_reader(pdfname, **kwargs):
@@ -23,14 +29,91 @@ def get_root_of_reader(reader):
 
 # writer
 def new_writer():
-    return PdfFileWriter()
+    return PdfWriter()
+
+class PdfWriter(PdfFileWriter):
+    '''
+        PyPDF2 writer, with references swept without recursion in writing
+
+        PyPDF2 sweeps references recursively,
+            which goes as deep as long chain, e.g. /Next of outlines,
+                and fails with `RecursionError`
+    '''
+    def _sweepIndirectReferences(self, externMap, data):
+        '''
+            same as in PyPDF2, but containers to sweep are kept in a stack
+
+            external objects are copied into writer,
+                and direct streams in containers are made indirect
+        '''
+        visited=set(self.stack)  # idnums of internal objects swept
+        todo=[]                  # dicts and arrays to sweep
+
+        def sweep(value):
+            if isinstance(value, (PDF.DictionaryObject, PDF.ArrayObject)):
+                todo.append(value)
+                return value
+
+            if not isinstance(value, PDF.IndirectObject):
+                return value
+
+            # internal reference
+            if value.pdf==self:
+                if value.idnum not in visited:
+                    visited.add(value.idnum)
+                    sweep(self.getObject(value))
+                return value
+
+            # external reference, copied as new object
+            refs=externMap.setdefault(value.pdf, {}).setdefault(value.generation, {})
+            if value.idnum in refs:
+                return refs[value.idnum]
+
+            try:
+                obj=value.pdf.getObject(value)
+            except ValueError:
+                # unable to resolve the object
+                return PDF.NullObject()
+
+            self._objects.append(None)  # placeholder
+            ref=PDF.IndirectObject(len(self._objects), 0, self)
+            refs[value.idnum]=ref
+
+            self._objects[ref.idnum-1]=sweep(obj)
+
+            return ref
+
+        def sweep_item(value):
+            value=sweep(value)
+            if isinstance(value, PDF.StreamObject):
+                # streams must be indirect objects
+                value=self._addObject(value)
+            return value
+
+        result=sweep(data)
+        while todo:
+            obj=todo.pop()
+            if isinstance(obj, PDF.DictionaryObject):
+                for key, value in list(obj.items()):
+                    obj[key]=sweep_item(value)
+            else:
+                for i in range(len(obj)):
+                    obj[i]=sweep_item(obj[i])
+
+        return result
 
 def write_pdf_to(pdfname, writer):
     '''
         save writer to a PDF file
     '''
-    with open(pdfname, 'wb') as f:
-        writer.write(f)
+    with span('serialize', fname=pdfname):
+        if isinstance(writer, IncrementalWriter):
+            writer.write_to(pdfname)
+        else:
+            with open(pdfname, 'wb') as f:
+                writer.write(f)
+
+    count('bytes written', os.path.getsize(pdfname))
 
 def get_root_of_writer(writer):
     '''
@@ -38,12 +121,315 @@ def get_root_of_writer(writer):
     '''
     return writer._root_object
 
+def get_page_refs_of_writer(writer):
+    '''
+        list of indirect references of pages in writer
+    '''
+    if isinstance(writer, IncrementalWriter):
+        return [writer.getPageRef(i) for i in range(writer.getNumPages())]
+
+    return list(writer.getObject(writer._pages)['/Kids'])
+
+def get_outline_root_ref_of_writer(writer):
+    '''
+        indirect reference of outline root in writer
+
+        create one if not existed
+    '''
+    if isinstance(writer, IncrementalWriter):
+        return writer.getOutlineRootRef()
+
+    root=writer._root_object
+    if '/Outlines' in root:
+        return root.raw_get('/Outlines')
+
+    outline=PDF.DictionaryObject()
+    outline[PDF.NameObject('/Type')]=PDF.NameObject('/Outlines')
+
+    ref=writer._addObject(outline)
+    root[PDF.NameObject('/Outlines')]=ref
+
+    return ref
+
+def get_object_to_update(writer, ref):
+    '''
+        get an object in writer, which would be changed in place
+
+        for `IncrementalWriter`, the object is marked as changed
+    '''
+    if isinstance(writer, IncrementalWriter):
+        return writer.updateObject(ref)
+
+    return writer.getObject(ref)
+
 # reader/writer
 def get_root_of_rw(rw):
     if isinstance(rw, PdfFileReader):
         return get_root_of_reader(rw)
 
-    if isinstance(rw, PdfFileWriter):
+    if isinstance(rw, (PdfFileWriter, IncrementalWriter)):
         return get_root_of_writer(rw)
 
-    raise Exception('unexpected type:', type(rw))
\ No newline at end of file
+    raise Exception('unexpected type:', type(rw))
+
+# incremental update
+class IncrementalWriter:
+    '''
+        writer to save a PDF by incremental update
+
+        only objects added or changed are appended to the original file,
+            along with a new xref section
+                and the pages, e.g. image streams, are never re-serialized
+
+        methods used in other functions for `PdfFileWriter` are provided,
+            e.g. `getNumPages`, `getPage`, `addBookmark`, `_addObject`
+    '''
+    def __init__(self, pdfname, strict=False):
+        self.pdfname=pdfname
+        self.reader=open_pdf_as_reader(pdfname, strict=strict)
+
+        if self.reader.isEncrypted:
+            raise Exception('incremental update not supported for encrypted PDF')
+
+        trailer=self.reader.trailer
+        self._root=trailer.raw_get('/Root')
+        self._root_object=trailer['/Root']
+
+        self._size=get_size_of_reader(self.reader)  # next object number
+        self._objects={}  # objects to write, {idnum: (generation, object)}
+
+    # pages
+    def getNumPages(self):
+        return self.reader.getNumPages()
+
+    def getPage(self, pageNumber):
+        return self.reader.getPage(pageNumber)
+
+    def getPageRef(self, pageNumber):
+        '''
+            indirect reference of a page
+        '''
+        return self.reader.getPage(pageNumber).indirectRef
+
+    # objects
+    def _addObject(self, obj):
+        '''
+            add a new object
+
+            return its indirect reference
+        '''
+        ref=PDF.IndirectObject(self._size, 0, self)
+        self._objects[ref.idnum]=(0, obj)
+        self._size+=1
+
+        return ref
+
+    def getObject(self, ido):
+        if ido.idnum in self._objects:
+            return self._objects[ido.idnum][1]
+
+        return self.reader.getObject(ido)
+
+    def updateObject(self, ido, obj=None):
+        '''
+            mark an object in original file as changed
+
+            Parameters:
+                obj: None or PDF object
+                    new content of the object
+                    if None, use the one loaded in reader
+
+                    pages got from reader are copies of the original objects,
+                        so they must be given explicitly
+
+            return the object
+        '''
+        if obj is not None:
+            self._objects[ido.idnum]=(ido.generation, obj)
+        elif ido.idnum not in self._objects:
+            self._objects[ido.idnum]=(ido.generation, self.reader.getObject(ido))
+
+        return self._objects[ido.idnum][1]
+
+    # outline
+    def getOutlineRootRef(self):
+        '''
+            indirect reference of outline root
+
+            create one if not existed
+        '''
+        root=self._root_object
+
+        if '/Outlines' in root:
+            ref=root.raw_get('/Outlines')
+            self.updateObject(ref)
+        else:
+            outline=PDF.DictionaryObject()
+            outline[PDF.NameObject('/Type')]=PDF.NameObject('/Outlines')
+
+            ref=self._addObject(outline)
+            root[PDF.NameObject('/Outlines')]=ref
+
+        return ref
+
+    def addBookmark(self, title, pagenum, parent=None, fit='/Fit'):
+        '''
+            add a bookmark, with the same interface as `PdfFileWriter.addBookmark`
+
+            return indirect reference of the bookmark
+        '''
+        dest=PDF.ArrayObject([self.getPageRef(pagenum), PDF.NameObject(fit)])
+
+        bookmark=PDF.DictionaryObject()
+        bookmark.update({
+            PDF.NameObject('/Title'): PDF.createStringObject(title),
+            PDF.NameObject('/Dest'): dest,
+        })
+        ref=self._addObject(bookmark)
+
+        if parent is None:
+            parent=self.getOutlineRootRef()
+
+        self._add_outline_child(parent, ref)
+
+        return ref
+
+    def _add_outline_child(self, parent, child):
+        '''
+            link a child at the end of children of parent
+        '''
+        parent_obj=self.updateObject(parent)
+        child_obj=self.getObject(child)
+
+        if '/First' not in parent_obj:
+            parent_obj[PDF.NameObject('/First')]=child
+            count=0
+        else:
+            last=parent_obj.raw_get('/Last')
+            self.updateObject(last)[PDF.NameObject('/Next')]=child
+            child_obj[PDF.NameObject('/Prev')]=last
+
+            count=int(parent_obj.get('/Count', 0))
+
+        parent_obj[PDF.NameObject('/Last')]=child
+        parent_obj[PDF.NameObject('/Count')]=PDF.NumberObject(count+1)
+
+        child_obj[PDF.NameObject('/Parent')]=parent
+
+    # write
+    def write_to(self, pdfname):
+        '''
+            save to a PDF file
+
+            if `pdfname` is the original file, changes are appended to it in place
+                otherwise, original file is copied first
+        '''
+        if not (os.path.exists(pdfname) and os.path.samefile(pdfname, self.pdfname)):
+            shutil.copyfile(self.pdfname, pdfname)
+
+        with open(pdfname, 'r+b') as f:
+            f.seek(0, os.SEEK_END)
+            self.write(f)
+
+    def write(self, stream):
+        '''
+            append objects changed and a xref section to a stream
+                which is at the end of the original file
+        '''
+        prev=get_startxref_of_stream(stream)
+
+        # page labels may be changed in place, e.g. an indirect /Nums array
+        #     so they are rebuilt in catalog, avoiding circular import
+        from .funcs_pagelabel import normalize_pagelabels
+        normalize_pagelabels(self)
+
+        # catalog
+        self.updateObject(self._root)
+
+        # objects
+        stream.write(b'\n')
+
+        offsets={}
+        for idnum in sorted(self._objects):
+            gen, obj=self._objects[idnum]
+            offsets[idnum]=(stream.tell(), gen)
+
+            stream.write(b'%d %d obj\n' % (idnum, gen))
+            obj.writeToStream(stream, None)
+            stream.write(b'\nendobj\n')
+
+        # xref
+        xref=stream.tell()
+        stream.write(b'xref\n')
+        stream.write(b'0 1\n%010d %05d f\r\n' % (0, 65535))
+        for start, ids in split_to_continuing_runs(sorted(offsets)):
+            stream.write(b'%d %d\n' % (start, len(ids)))
+            for i in ids:
+                stream.write(b'%010d %05d n\r\n' % offsets[i])
+
+        # trailer
+        trailer=PDF.DictionaryObject()
+        trailer.update({
+            PDF.NameObject('/Size'): PDF.NumberObject(self._size),
+            PDF.NameObject('/Root'): self._root,
+            PDF.NameObject('/Prev'): PDF.NumberObject(prev),
+        })
+        for k in ['/Info', '/ID']:
+            if k in self.reader.trailer:
+                trailer[PDF.NameObject(k)]=self.reader.trailer.raw_get(k)
+
+        stream.write(b'trailer\n')
+        trailer.writeToStream(stream, None)
+        stream.write(b'\nstartxref\n%d\n%%%%EOF\n' % xref)
+
+def get_size_of_reader(reader):
+    '''
+        number of objects in reader, that is max object number plus 1
+
+        `/Size` is missed in trailer of PyPDF2 reader for PDF with xref stream,
+            in which case, it is computed from xref
+    '''
+    if '/Size' in reader.trailer:
+        return int(reader.trailer['/Size'])
+
+    ids=list(reader.xref_objStm)
+    for xref in reader.xref.values():
+        ids.extend(xref)
+
+    return max(ids)+1
+
+def get_startxref_of_stream(stream, tail=1024):
+    '''
+        offset of last xref section, given at the end of a PDF stream
+
+        position of stream is kept
+    '''
+    pos=stream.tell()
+
+    stream.seek(0, os.SEEK_END)
+    size=stream.tell()
+
+    stream.seek(max(0, size-tail))
+    data=stream.read()
+    stream.seek(pos)
+
+    i=data.rfind(b'startxref')
+    if i<0:
+        raise Exception('startxref not found')
+
+    return int(data[i+len(b'startxref'):].split()[0])
+
+def split_to_continuing_runs(nums):
+    '''
+        split sorted integers into runs of continuing numbers
+
+        return list of (start, list of numbers)
+    '''
+    runs=[]
+    for n in nums:
+        if runs and n==runs[-1][1][-1]+1:
+            runs[-1][1].append(n)
+        else:
+            runs.append((n, [n]))
+
+    return runs
@@ -0,0 +1,163 @@
+#!/usr/bin/env python3
+
+'''
+Functions for tracing
+
+an opt-in tracing layer, which records nested spans with timings and counters,
+    and exports them as Chrome trace JSON
+        which could be viewed in chrome://tracing or Perfetto
+
+tracing is disabled by default
+    in which case `span` returns a shared null context,
+        and other functions return immediately
+
+usage:
+    enable_tracing()
+
+    with span('copy_pdf', fname=fname):
+        ...
+        count('pages copied')
+
+    or decorate a function with `traced`, to record a span for each call
+
+    export_chrome_trace('trace.json')
+
+only events in current process are recorded
+'''
+
+import os
+import json
+import time
+import threading
+import functools
+import contextlib
+
+_events=None      # list of events if enabled, otherwise None
+_counters={}      # accumulated values of counters
+_t0=0             # start time in second
+
+_null_span=contextlib.nullcontext()
+
+# switch
+def enable_tracing():
+    '''
+        enable tracing, and drop events recorded before
+    '''
+    global _events, _counters, _t0
+    _events=[]
+    _counters={}
+    _t0=time.perf_counter()
+
+def disable_tracing():
+    '''
+        disable tracing
+
+        return events recorded
+    '''
+    global _events
+    events, _events=_events, None
+
+    return events
+
+def is_tracing():
+    return _events is not None
+
+# events
+def _timestamp():
+    '''
+        timestamp in microsecond since tracing enabled
+    '''
+    return (time.perf_counter()-_t0)*1e6
+
+def _add_event(ph, name, ts, **kwargs):
+    event=dict(name=name, ph=ph, ts=ts, pid=os.getpid(), tid=threading.get_ident())
+    event.update(kwargs)
+
+    _events.append(event)
+
+class _Span:
+    '''
+        span recorded as a complete event in Chrome trace
+    '''
+    __slots__=('name', 'args', 'ts')
+
+    def __init__(self, name, args):
+        self.name=name
+        self.args=args
+
+    def __enter__(self):
+        self.ts=_timestamp()
+        return self
+
+    def __exit__(self, *exc):
+        if _events is not None:
+            _add_event('X', self.name, self.ts, dur=_timestamp()-self.ts, args=self.args)
+
+        return False
+
+def span(name, **args):
+    '''
+        context manager for a span with `name`
+
+        spans nested in time are shown nestedly
+    '''
+    if _events is None:
+        return _null_span
+
+    return _Span(name, args)
+
+def traced(func):
+    '''
+        decorator to record a span for each call of a function
+
+        not for generator function,
+            since only creation of generator would be recorded
+    '''
+    name=func.__name__
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        if _events is None:
+            return func(*args, **kwargs)
+
+        with _Span(name, {}):
+            return func(*args, **kwargs)
+
+    return wrapper
+
+def count(name, n=1):
+    '''
+        increase a counter by `n`, and record its accumulated value
+    '''
+    if _events is None:
+        return
+
+    v=_counters.get(name, 0)+n
+    _counters[name]=v
+
+    _add_event('C', name, _timestamp(), args={name: v})
+
+def instant(name, **args):
+    '''
+        record an instant event
+    '''
+    if _events is None:
+        return
+
+    _add_event('i', name, _timestamp(), s='t', args=args)
+
+def get_counters():
+    '''
+        accumulated values of counters
+    '''
+    return dict(_counters)
+
+# export
+def export_chrome_trace(fname):
+    '''
+        export events recorded to a file in Chrome trace JSON
+    '''
+    events=[] if _events is None else _events
+
+    with open(fname, 'w') as f:
+        json.dump({'traceEvents': events, 'displayTimeUnit': 'ms'}, f)
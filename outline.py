@@ -4,7 +4,14 @@
 class to handle outline
 '''
 
-import re
+import array
+
+import numpy as np
+
+from .funcs_outline import get_page_index_map, get_dest_page_number, \
+                           iter_outline_txt, parse_outline_line, get_outlines_from_pdf, \
+                           str_clean_unprintable, pagenum_parse, level_parser_sec, \
+                           get_level_parser_map
 
 class OutlineEntry:
     '''
@@ -54,19 +61,25 @@ class OutlineEntry:
             self.add_child(child)
 
     ## from PDF reader outlines
-    def add_children_from_pdfreader_outlines(self, outlines):
+    def add_children_from_pdfreader_outlines(self, outlines, pagemap):
         '''
             load outline from pdf reader outline struture
                 which is nested layout
+
+            `pagemap`: map from page object to page index
+                see `funcs_outline.get_page_index_map` for detail
+
+            unprintable chars in titles are removed,
+                same as `funcs_outline.get_outlines_from_pdf`
         '''
         for entry in outlines:
             if '/Title' in entry:
-                title=entry['/Title']
-                page=entry.page.pdf.getDestinationPageNumber(entry)
+                title=str_clean_unprintable(entry['/Title'])
+                page=get_dest_page_number(entry, pagemap)
                 self.add_child_from_page(title, page)
                 continue
 
-            self.last_child.add_children_from_pdfreader_outlines(entry)
+            self.last_child.add_children_from_pdfreader_outlines(entry, pagemap)
 
     # to list
     ## list flattenly
@@ -196,10 +209,18 @@ class Outline(OutlineEntry):
     # read outlines from files: text or pdf
 
     ## from pdf
-    def load_pdf(self, pdfname):
+    def load_pdf(self, pdfname, cache=None):
         '''
             read outline from pdf file
+
+            `cache`: None, str or `DirCache`
+                cache of flatten outlines,
+                    see `funcs_outline.get_outlines_from_pdf` for detail
         '''
+        if cache is not None:
+            self.add_entries_by_level(get_outlines_from_pdf(pdfname, cache=cache))
+            return
+
         from PyPDF2 import PdfFileReader
         reader=PdfFileReader(open(pdfname, 'rb'))
 
@@ -210,7 +231,9 @@ class Outline(OutlineEntry):
             read outlines from from PyPDF2 reader
         '''
         outlines=reader.getOutlines()
-        self.add_children_from_pdfreader_outlines(outlines)
+        pagemap=get_page_index_map(reader)
+
+        self.add_children_from_pdfreader_outlines(outlines, pagemap)
 
     ## from text
     def load_level_txt(self, fname, lstrip=True,
@@ -230,13 +253,13 @@ class Outline(OutlineEntry):
                     if dict, e.g. {s: l}
                         for title starting with `s`, level is `l`
 
-                    see method `get_level_parser_from_map` for detail
+                    see `funcs_outline.compile_level_rules` for detail
 
                 parse_sec: bool or int
-                    wheter to parse section using `level_parser_sec`
+                    wheter to parse section using `funcs_outline.level_parser_sec`
 
                     if int, parse section
-                        and use the integral as `level_shift` in `level_parser_sec`
+                        and use the integral as level shift
 
                     or list of tuples: [(s, l)], [((s1, s2), l)]
                         title starting with `s(1/2)`, level is `l`
@@ -257,75 +280,50 @@ class Outline(OutlineEntry):
                     left strip will remove spaces at the starting of title
 
         '''
-        # strip
-        strip=lambda line: line.rstrip()
-        if lstrip:
-            strip=lambda line: line.strip()
+        self.add_entries_by_level(Outline.iter_level_txt(fname, lstrip=lstrip,
+                                        map_levels=map_levels, parse_sec=parse_sec,
+                                        func_level=func_level, level_default=level_default))
 
-        # level parsers
-        parsers=[]
-
-        ## map of levels
-        if map_levels:
-            parsers.append(Outline.get_level_parser_from_map(map_levels))
-
-        ## parse_sec
-        if isinstance(parse_sec, numbers.Integral):
-            func_sec=lambda t, p, l=parse_sec: Outline.level_parser_sec(t, p, l)
-            parsers.append(funcs_sec)
-        elif parse_sec:
-            parsers.append(Outline.level_parser_sec)
-
-        ## func level
-        if func_level is not None:
-            parsers.append(funcs_sec)
-
-        func_parser=Outline.combine_level_parsers(*parsers)
-
-        ## level default
-        if level_default is None:
-            # use previous level
-            use_default=False
-            level_now=None
-        else:
-            assert isinstance(level_default, numbers.Integral)
-            use_default=True
-            level_now=level_default
+    def add_entries_by_level(self, entries):
+        '''
+            add entries (title, page, level) in flatten list
 
-        # load text
+            entry with level None is added as sibling of previous one
+        '''
         holder=self
         levels=[]
-        with open(fname) as f:
-            for line in f:
-                title, pnumstr=strip(line).rsplit(maxsplit=1)
-
-                # page number, outline level
-                page, level=Outline.pagenum_parse(pnumstr)
-
-                # outline level
-                if level is None:
-                    level=func_parser(title, page)
+        for title, page, level in entries:
+            if level is not None:
+                if not levels:
+                    levels.append(level)
+                elif level>levels[-1]:
+                    holder=holder.last_child
+                    levels.append(level)
+                elif level<levels[-1]:
+                    while levels[-1]>level:
+                        holder=holder.parent
+                        levels.pop()
 
-                    if level is None:
-                        level=level_now
+                    assert levels[-1]==level
 
-                if not use_default:
-                    level_now=level
+            holder.add_child_from_page(title, page)
 
-                if level is not None:
-                    if not levels:
-                        levels.append(level)
-                    elif level>levels[-1]:
-                        holder=holder.last_child
-                        levels.append(level)
-                    elif level<levels[-1]:
-                        while levels[-1]>level:
-                            holder=holder.parent
-                            levels.pop()
+    @staticmethod
+    def iter_level_txt(fname, lstrip=True,
+                            map_levels={}, parse_sec=False, func_level=None,
+                            level_default=0):
+        '''
+            iterate lines of text file, loaded by `load_level_txt`
 
-                        assert levels[-1]==level
+            yield (title, page, level)
+                where level is None if not determined
 
-                holder.add_child_from_page(title, page)
+            see `load_level_txt` for parameters
+                and `funcs_outline.iter_outline_txt` for the parser
+        '''
+        return iter_outline_txt(fname, lstrip=lstrip,
+                                map_levels=map_levels, parse_sec=parse_sec,
+                                func_level=func_level, level_default=level_default)
 
     def load_nest_txt(self, fname, delimiters=('/*', '*/'), lstrip=True):
         '''
@@ -338,11 +336,6 @@ class Outline(OutlineEntry):
                     whether to do left strip to line of outline file
                     left strip will remove spaces at the starting of title
         '''
-        # strip
-        strip=lambda line: line.rstrip()
-        if lstrip:
-            strip=lambda line: line.strip()
-
         # delimiters
         if type(delimiters) is str:
             d0=d1=delimiters
@@ -373,10 +366,9 @@ class Outline(OutlineEntry):
                         holder=self
                         at_head=False
 
-                    title, page=strip(line).rsplit(maxsplit=1)
-                    page=int(page)
-
-                    holder.add_child_from_page(title, page)
+                    entry=parse_outline_line(line, lstrip=lstrip)
+                    if entry is not None:
+                        holder.add_child_from_page(entry[0], entry[1])
 
     def load_indent_txt(self, fname):
         '''
@@ -391,19 +383,9 @@ class Outline(OutlineEntry):
         '''
             parse string for pagenum in text outline file
 
-            two formats:
-                xxx: an interger
-                    only contain page number
-                xxxLxxx or xxxlxxx: aLb
-                    a: page number
-                    b: outline level
+            see `funcs_outline.pagenum_parse` for detail
         '''
-        nums=pnumstr.lower().split('l')
-        if len(nums)==1:
-            return int(nums[0]), None
-
-        num, level=nums
-        return int(num), int(level)
+        return pagenum_parse(pnumstr)
 
     @staticmethod
     def level_parser_sec(title, page, level_shfit=0):
@@ -416,36 +398,19 @@ class Outline(OutlineEntry):
                     level shift,
                         that means level of e.g. 1.1 is 1+`level_shift`
         '''
-        sec, *_=title.split(maxsplit=1)
-        m=re.search(r'([\dIVX]+(\.\d+)*)', sec)
-        if m:
-            return len(m.groups()[0].split('.'))-1+level_shfit
+        level=level_parser_sec(title, page, level_default=None)
+        if level is None:
+            return None
 
-        return None
+        return level+level_shfit
 
     @staticmethod
     def get_level_parser_from_map(map_levels):
         '''
             get a level parser which is based on a map from title starting to level
+                see `funcs_outline.compile_level_rules` for `map_levels`
         '''
-        if str(map_levels) is not dict:
-            # if not dict, must be [(list of strings, level)]
-            level_list=map_levels
-            map_levels={}
-            for names, level in level_list:
-                if type(names) is not str:
-                    for n in names:
-                        map_levels[n]=level
-                else:
-                    map_levels[names]=level
-
-        def parser(title, page):
-            starting=title.split(maxsplit=1)[0]
-            if starting in map_levels:
-                return map_levels[starting]
-            return None
-
-        return parser
+        return get_level_parser_map(map_levels, level_default=None)
 
     @staticmethod
     def combine_level_parsers(*parsers):
@@ -514,3 +479,362 @@ class Outline(OutlineEntry):
         with open(fname, 'w') as f:
             self._write_children_to_txt_nest(f, d0, d1, 0)
 
+
+# compact outline
+class CompactOutlineEntry:
+    '''
+        view of an entry in `CompactOutline`
+
+        no data stored, except the outline and index of entry
+    '''
+    __slots__=('outline', 'index')
+
+    def __init__(self, outline, index):
+        self.outline=outline
+        self.index=index
+
+    # properties
+    @property
+    def title(self):
+        return self.outline._titles[self.index]
+
+    @property
+    def page(self):
+        return self.outline._pages[self.index]
+
+    @property
+    def level(self):
+        return self.outline._levels[self.index]
+
+    @property
+    def parent(self):
+        '''
+            parent entry, or the outline for top level
+        '''
+        return self.outline.entry(self.outline._parents[self.index])
+
+    @property
+    def children(self):
+        return [self.outline.entry(i) for i in self.outline.children_of(self.index)]
+
+    @property
+    def last_child(self):
+        return self.outline.entry(self.outline.last_child_of(self.index))
+
+    # children
+    def add_child_from_page(self, title, page):
+        '''
+            add child for given (title, page)
+        '''
+        self.outline.append(title, page, self.index)
+
+class CompactOutline:
+    '''
+        outline stored in parallel arrays, for very large outlines
+
+        entries are identified by index, and -1 for root
+            arrays of title, page number, level and index of parent
+
+        interface is same as `Outline`
+            and traversals are iterative, without limit of depth
+    '''
+    def __init__(self):
+        self._titles=[]
+        self._pages=array.array('l')
+        self._levels=array.array('l')
+        self._parents=array.array('l')
+
+        self._last_children={}   # {parent: last child}
+        self._csr=None           # cache of children arrays, see `_get_children_arrays`
+
+    def __len__(self):
+        return len(self._titles)
+
+    # entries
+    def entry(self, index):
+        '''
+            view of an entry
+
+            return the outline itself for root, that is index -1
+        '''
+        if index<0:
+            return self
+        return CompactOutlineEntry(self, index)
+
+    def append(self, title, page, parent=-1):
+        '''
+            append an entry as last child of `parent`
+
+            return index of new entry
+        '''
+        level=0 if parent<0 else self._levels[parent]+1
+
+        index=len(self._titles)
+
+        self._titles.append(title)
+        self._pages.append(page)
+        self._levels.append(level)
+        self._parents.append(parent)
+
+        self._last_children[parent]=index
+        self._csr=None
+
+        return index
+
+    def last_child_of(self, index):
+        return self._last_children[index]
+
+    def children_of(self, index):
+        '''
+            indices of children of an entry
+        '''
+        starts, order=self._get_children_arrays()
+
+        i=index+1   # shift for root
+        return order[starts[i]:starts[i+1]].tolist()
+
+    def _get_children_arrays(self):
+        '''
+            children of all entries, in compressed form
+                children of entry `i` are `order[starts[i+1]:starts[i+2]]`
+
+            built by stable sort of parents, and cached until next change
+        '''
+        if self._csr is None:
+            parents=np.frombuffer(self._parents, dtype=self._parents.typecode)+1
+
+            starts=np.zeros(len(parents)+2, dtype=int)
+            np.cumsum(np.bincount(parents, minlength=len(parents)+1), out=starts[1:])
+
+            order=np.argsort(parents, kind='stable')
+
+            self._csr=(starts, order)
+
+        return self._csr
+
+    ## same interface as `OutlineEntry`
+    @property
+    def children(self):
+        return [self.entry(i) for i in self.children_of(-1)]
+
+    @property
+    def last_child(self):
+        return self.entry(self.last_child_of(-1))
+
+    def add_child_from_page(self, title, page):
+        self.append(title, page)
+
+    def add_children(self, children):
+        for title, page in children:
+            self.append(title, page)
+
+    # read outlines from files: text or pdf
+
+    ## from pdf
+    def load_pdf(self, pdfname, cache=None):
+        '''
+            read outline from pdf file
+
+            `cache`: None, str or `DirCache`
+                cache of flatten outlines,
+                    see `funcs_outline.get_outlines_from_pdf` for detail
+        '''
+        if cache is not None:
+            self.add_entries_by_level(get_outlines_from_pdf(pdfname, cache=cache))
+            return
+
+        from PyPDF2 import PdfFileReader
+        reader=PdfFileReader(open(pdfname, 'rb'))
+
+        self.load_pdfreader(reader)
+
+    def load_pdfreader(self, reader):
+        '''
+            read outlines from from PyPDF2 reader
+
+            unprintable chars in titles are removed,
+                same as `funcs_outline.get_outlines_from_pdf`
+        '''
+        outlines=reader.getOutlines()
+        pagemap=get_page_index_map(reader)
+
+        # stack of (iterator of nested list, parent index)
+        stack=[(iter(outlines), -1)]
+        while stack:
+            entries, parent=stack[-1]
+
+            entry=next(entries, None)
+            if entry is None:
+                stack.pop()
+            elif '/Title' in entry:
+                page=get_dest_page_number(entry, pagemap)
+                self.append(str_clean_unprintable(entry['/Title']), page, parent)
+            else:
+                stack.append((iter(entry), self.last_child_of(parent)))
+
+    ## from text
+    def load_level_txt(self, fname, **kwargs):
+        '''
+            load text file
+                see `Outline.load_level_txt` for detail
+        '''
+        self.add_entries_by_level(Outline.iter_level_txt(fname, **kwargs))
+
+    def add_entries_by_level(self, entries):
+        '''
+            add entries (title, page, level) in flatten list
+                see `Outline.add_entries_by_level` for detail
+        '''
+        holder=-1
+        levels=[]
+        for title, page, level in entries:
+            if level is not None:
+                if not levels:
+                    levels.append(level)
+                elif level>levels[-1]:
+                    holder=self.last_child_of(holder)
+                    levels.append(level)
+                elif level<levels[-1]:
+                    while levels[-1]>level:
+                        holder=self._parents[holder]
+                        levels.pop()
+
+                    assert levels[-1]==level
+
+            self.append(title, page, holder)
+
+    def load_nest_txt(self, fname, delimiters=('/*', '*/'), lstrip=True):
+        '''
+            load nest file
+                see `Outline.load_nest_txt` for detail
+        '''
+        # delimiters
+        if type(delimiters) is str:
+            d0=d1=delimiters
+        else:
+            d0, d1=delimiters
+
+        # load text
+        holder=None
+        at_head=True
+
+        with open(fname) as f:
+            for line in f:
+                lsline=line.lstrip()
+                if lsline.startswith(d0):
+                    if holder is None and at_head:
+                        holder=-1
+                        at_head=False
+                    else:
+                        holder=self.last_child_of(holder)
+                elif lsline.startswith(d1):
+                    if holder<0:
+                        holder=None
+                    else:
+                        holder=self._parents[holder]
+                else:
+                    # delimiter at head could be missed
+                    if holder is None and at_head:
+                        holder=-1
+                        at_head=False
+
+                    entry=parse_outline_line(line, lstrip=lstrip)
+                    if entry is not None:
+                        self.append(entry[0], entry[1], holder)
+
+    # traversal
+    def iter_preorder(self):
+        '''
+            iterate indices of entries in preorder
+                with a stack, instead of recursion
+        '''
+        starts, order=self._get_children_arrays()
+
+        # stack of [next position in `order`, end position]
+        stack=[[starts[0], starts[1]]]
+        while stack:
+            frame=stack[-1]
+            if frame[0]>=frame[1]:
+                stack.pop()
+                continue
+
+            i=int(order[frame[0]])
+            frame[0]+=1
+
+            yield i
+            stack.append([starts[i+1], starts[i+2]])
+
+    ## list flattenly
+    def iter_flatten(self, level=0):
+        '''
+            convert to a flatten list
+                each entry with format, (title, page, level)
+
+            Paremeter:
+                level: int
+                    initial level
+        '''
+        titles, pages, levels=self._titles, self._pages, self._levels
+        for i in self.iter_preorder():
+            yield titles[i], pages[i], levels[i]+level
+
+    def to_flatten_list(self):
+        '''
+            convert to flatten list
+        '''
+        return list(self.iter_flatten())
+
+    ## to nested list
+    def to_nested_list(self):
+        '''
+            convert to nested list, e.g. [(t1, p1), [(t2, p2), (t3, p3)]]
+        '''
+        root=[]
+
+        holders=[root]   # holders[l]: list of children at level l
+        for i in self.iter_preorder():
+            l=self._levels[i]
+            del holders[l+1:]
+
+            if len(holders)<=l:
+                holders[-1].append([])
+                holders.append(holders[-1][-1])
+
+            holders[l].append((self._titles[i], self._pages[i]))
+
+        return root
+
+    # write to text
+    def write_to_txt_flatten(self, fname, indent=False):
+        '''
+            write to text file in a flatten way
+        '''
+        with open(fname, 'w') as f:
+            for t, p, l in self.iter_flatten():
+                OutlineEntry._write_title_page(f, t, p, l, indent=indent)
+
+    def write_to_txt_nest(self, fname, delimiters=('/*', '*/')):
+        '''
+            write to text file in a nest way
+        '''
+        if type(delimiters) is str:
+            d0=d1=delimiters
+        else:
+            d0, d1=delimiters
+
+        with open(fname, 'w') as f:
+            opened=[]   # ids of open delimiters, one for each level
+            i=0
+            for t, p, l in self.iter_flatten():
+                while len(opened)>l+1:
+                    f.write('%s quote %i\n' % (d1, opened.pop()))
+
+                if len(opened)<l+1:
+                    f.write('%s quote %i\n' % (d0, i))
+                    opened.append(i)
+                    i+=1
+
+                OutlineEntry._write_title_page(f, t, p)
+
+            while opened:
+                f.write('%s quote %i\n' % (d1, opened.pop()))
@@ -4,17 +4,38 @@
 class to handle pdf operations
 '''
 
-from PyPDF2 import PdfFileReader, PdfFileWriter
+from .funcs_rw import open_pdf_as_reader, new_writer, write_pdf_to
+from .funcs_page import page_clean_annots, page_resize, add_blank_pages_after
+from .funcs_pagelabel import add_pagelabel, normalize_pagelabels
+from .funcs_outline import add_outlines
 
 class PDFEditor:
     '''
         class to handle pdf operations
+
+        operations are recorded in a plan,
+            and executed in one pass over pages when saved
+                pdf files are not read until then,
+                    and then read one by one, with pages copied to a writer
+
+        two kinds of operations:
+            page operation: called as `op(page)` for each page
+                only pages of pdf files loaded before the operation recorded,
+                    same as done immediately
+            document operation: called as `op(writer)` after all pages copied,
+                in the order they are recorded
+                pages in it are given by index in the whole merged document
     '''
     def __init__(self, pdfname=None):
         '''
-            open a pdf file and initiate a writer
+            open a pdf file and initiate a plan
         '''
-        self.writer=PdfFileWriter()
+        self.pdfnames=[]
+
+        self.page_ops=[]  # (op, number of pdf files it works on)
+        self.doc_ops=[]
+
+        self._writer=None  # writer of executed plan
 
         if pdfname is not None:
             self.load_pdf(pdfname)
@@ -24,27 +45,103 @@ class PDFEditor:
         '''
             load pdf file
         '''
-        reader=PdfFileReader(open(pdfname, 'rb'))
-        nump=reader.getNumPages()
+        self.pdfnames.append(pdfname)
+        self._writer=None
 
-        for i in range(nump):
-            page=reader.getPage(i)
-            self.writer.addPage(page)
+    # record operations
+    def add_page_op(self, op):
+        '''
+            record an operation on each page of pdf files loaded so far
+        '''
+        self.page_ops.append((op, len(self.pdfnames)))
+        self._writer=None
+
+    def add_doc_op(self, op):
+        '''
+            record an operation on the whole document
+        '''
+        self.doc_ops.append(op)
+        self._writer=None
 
-    # annotation
+    ## annotation
     def clean_annots(self):
         '''
             clean annots in all pages
         '''
-        nump=self.writer.getNumPages()
+        self.add_page_op(page_clean_annots)
+
+    ## page size
+    def resize(self, pagesize=None, scale=None, keep_ratio=True, mode='wrap'):
+        '''
+            resize all pages
+
+            see `funcs_page.page_resize` for detail
+        '''
+        self.add_page_op(lambda page: page_resize(page, pagesize, scale, keep_ratio, mode))
+
+    ## blank pages
+    def add_blank_pages_after(self, pages):
+        '''
+            add blank pages after `pages`, given by index started from 1
+        '''
+        self.add_doc_op(lambda writer: add_blank_pages_after(writer, pages))
+
+    ## page labels
+    def add_pagelabel(self, page, style='arabic', start=None, prefix=None):
+        '''
+            add a page label starting at `page`, given by index started from 0
 
-        for i in range(nump):
-            page=self.writer.getPage(i) 
+            if `style` is '', pages are labeled by `prefix` only
+        '''
+        self.add_doc_op(lambda writer: add_pagelabel(writer, page, style, start, prefix))
+
+    ## outlines
+    def add_outlines(self, outlines):
+        '''
+            add outlines given by a list of entries [title, page number, level]
+        '''
+        self.add_doc_op(lambda writer: add_outlines(writer, outlines))
+
+    # execute
+    def execute(self):
+        '''
+            execute the plan in one pass over pages
+
+            return the writer
+                which is cached until the plan changes
+        '''
+        if self._writer is not None:
+            return self._writer
+
+        writer=new_writer()
 
-            if '/Annots' in page:
-                del page['/Annots']
+        for k, pdfname in enumerate(self.pdfnames):
+            reader=open_pdf_as_reader(pdfname)
+            page_ops=[op for op, n in self.page_ops if k<n]
+
+            for i in range(reader.getNumPages()):
+                page=reader.getPage(i)
+
+                for op in page_ops:
+                    op(page)
+
+                writer.addPage(page)
+
+        for op in self.doc_ops:
+            op(writer)
+        normalize_pagelabels(writer)
+
+        self._writer=writer
+
+        return writer
+
+    @property
+    def writer(self):
+        '''
+            writer of executed plan, see `execute`
+        '''
+        return self.execute()
 
     # save
     def save_to(self, fname):
-        with open(fname, 'wb') as f:
-            self.writer.write(f)
\ No newline at end of file
+        write_pdf_to(fname, self.execute())